@@ -0,0 +1,82 @@
+"""
+Access rules for files.
+
+Each action lists the access levels open to anonymous and to authenticated
+users; authors can always do everything with their own files. Rules only
+look at ``author_id``, so checks never load the author, and every rule can
+be used both on a file instance and as a queryset filter.
+"""
+from django.db.models import Q
+
+PUBLIC = 'public'
+BY_LINK = 'by_link'
+ONLY_AUTHOR = 'only_author'
+
+ACCESS_LEVELS = (PUBLIC, BY_LINK, ONLY_AUTHOR)
+
+# Listing files and reading them through the API.
+READ = 'read'
+# Opening view and download links.
+LINK = 'link'
+# Changing access and deleting.
+WRITE = 'write'
+
+RULES = {
+    READ: {
+        'anonymous': {PUBLIC},
+        'authenticated': {PUBLIC},
+    },
+    LINK: {
+        'anonymous': {PUBLIC},
+        'authenticated': {PUBLIC, BY_LINK},
+    },
+    WRITE: {
+        'anonymous': set(),
+        'authenticated': set(),
+    },
+}
+
+
+def _is_authenticated(user):
+    return user is not None and user.is_authenticated
+
+
+def allowed_levels(action, user):
+    rule = RULES[action]
+    return rule['authenticated'] if _is_authenticated(user) else rule['anonymous']
+
+
+def can(action, user, file):
+    if _is_authenticated(user) and file.author_id == user.pk:
+        return True
+    return file.access in allowed_levels(action, user)
+
+
+def access_filter(action, user):
+    """
+    Q object selecting the files ``user`` may ``action``.
+    """
+    query = Q(access__in=allowed_levels(action, user))
+    if _is_authenticated(user):
+        query |= Q(author_id=user.pk)
+    return query
+
+
+def filter_allowed(action, user, files):
+    """
+    Return the files of an already loaded sequence ``user`` may ``action``.
+    """
+    return [file for file in files if can(action, user, file)]
+
+
+def allowed_ids(action, user, ids, queryset=None):
+    """
+    Return the subset of file ids ``user`` may ``action``, in one query.
+    """
+    from .models import File
+
+    queryset = File.objects.all() if queryset is None else queryset
+    return set(
+        queryset.filter(access_filter(action, user), id__in=ids)
+        .values_list('id', flat=True)
+    )
@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.db import transaction
 
+from .bulk import delete_files
 from .models import File
+from .search import search_filter
 
 User = get_user_model()
 
@@ -16,9 +19,23 @@ class UserAdmin(admin.ModelAdmin):
 class FileAdmin(admin.ModelAdmin):
     list_display = ('id', 'author', 'access', 'file', 'download_count')
     empty_value_display = '-пусто-'
-    search_fields = ('access', 'author', 'file')
+    search_fields = ('name', 'author__username')
     list_filter = ('access', 'download_count', 'author')
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(search_filter(search_term)), False
+
+    # Deleted like through the API, so blobs and usage are released.
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            delete_files(File.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            delete_files(queryset)
+
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
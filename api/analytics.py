@@ -0,0 +1,164 @@
+"""
+Download analytics. Downloads are logged as DownloadEvent rows by the
+download counter, rolled up into hourly and daily DownloadRollup buckets
+in event id order behind a checkpoint, and compacted once rolled up.
+Reports only read the rollups.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min, Sum
+from django.utils import timezone
+
+from .jobs import enqueue, job
+from .models import DownloadEvent, DownloadRollup, Job, RollupCheckpoint
+
+CHECKPOINT = 'downloads'
+ROLLUP_JOB = 'analytics.roll_up'
+
+
+def bucket_start(moment, period):
+    moment = timezone.localtime(moment, timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if period == DownloadRollup.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def record(counts, occurred_at=None):
+    """
+    Log downloads given as ``{file_id: count}``. Call it in the transaction
+    that updates the download counters; events are stamped with the flush
+    time, which is within DOWNLOAD_COUNTER_FLUSH_INTERVAL of the downloads.
+    """
+    occurred_at = occurred_at or timezone.now()
+    DownloadEvent.objects.bulk_create([
+        DownloadEvent(file_id=file_id, count=count, occurred_at=occurred_at)
+        for file_id, count in counts.items()
+    ])
+
+
+def _add(period, totals):
+    """
+    Add ``{(bucket, file_id): count}`` to the rollups of ``period``.
+    """
+    existing = {
+        (bucket, file_id): pk
+        for pk, bucket, file_id in DownloadRollup.objects.filter(
+            period=period,
+            bucket__in={bucket for bucket, _ in totals},
+            file_id__in={file_id for _, file_id in totals}
+        ).values_list('pk', 'bucket', 'file_id')
+    }
+    by_delta = {}
+    for key, count in totals.items():
+        if key in existing:
+            by_delta.setdefault(count, []).append(existing[key])
+    for count, ids in by_delta.items():
+        DownloadRollup.objects.filter(pk__in=ids).update(count=F('count') + count)
+    DownloadRollup.objects.bulk_create([
+        DownloadRollup(period=period, bucket=bucket, file_id=file_id, count=count)
+        for (bucket, file_id), count in totals.items()
+        if (bucket, file_id) not in existing
+    ])
+
+
+def roll_up(batch_size=None, now=None):
+    """
+    Add the next batch of events to the rollups and move the checkpoint past
+    them. Only events older than DOWNLOAD_ROLLUP_DELAY are taken, and never
+    past a newer one, so events whose transaction commits late are not
+    skipped. Returns the number of events rolled up.
+    """
+    batch_size = batch_size or settings.DOWNLOAD_ROLLUP_BATCH_SIZE
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.DOWNLOAD_ROLLUP_DELAY)
+
+    with transaction.atomic():
+        checkpoint, _ = RollupCheckpoint.objects.get_or_create(name=CHECKPOINT)
+        checkpoint = RollupCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+        events = DownloadEvent.objects.filter(id__gt=checkpoint.position)
+        recent = events.filter(occurred_at__gte=cutoff).aggregate(first=Min('id'))['first']
+        if recent is not None:
+            events = events.filter(id__lt=recent)
+        batch = list(
+            events.order_by('id').values_list('id', 'file_id', 'count', 'occurred_at')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        for period in (DownloadRollup.HOUR, DownloadRollup.DAY):
+            totals = Counter()
+            for _, file_id, count, occurred_at in batch:
+                totals[bucket_start(occurred_at, period), file_id] += count
+            _add(period, totals)
+        checkpoint.position = batch[-1][0]
+        checkpoint.save(update_fields=['position'])
+    return len(batch)
+
+
+def compact(now=None):
+    """
+    Delete rolled up events older than DOWNLOAD_EVENT_RETENTION and hourly
+    rollups older than DOWNLOAD_HOURLY_RETENTION. Daily rollups are kept.
+    """
+    now = now or timezone.now()
+    position = RollupCheckpoint.objects.filter(name=CHECKPOINT).values_list(
+        'position', flat=True
+    ).first() or 0
+    events, _ = DownloadEvent.objects.filter(
+        id__lte=position,
+        occurred_at__lt=now - timedelta(seconds=settings.DOWNLOAD_EVENT_RETENTION)
+    ).delete()
+    hourly, _ = DownloadRollup.objects.filter(
+        period=DownloadRollup.HOUR,
+        bucket__lt=now - timedelta(seconds=settings.DOWNLOAD_HOURLY_RETENTION)
+    ).delete()
+    return events, hourly
+
+
+def schedule_roll_up():
+    """
+    Queue a roll-up job DOWNLOAD_ROLLUP_INTERVAL from now unless one is
+    already waiting.
+    """
+    if not Job.objects.filter(name=ROLLUP_JOB, status=Job.QUEUED).exists():
+        enqueue(ROLLUP_JOB, [{}], run_at=timezone.now() + timedelta(
+            seconds=settings.DOWNLOAD_ROLLUP_INTERVAL
+        ))
+
+
+@job(ROLLUP_JOB)
+def roll_up_downloads():
+    while roll_up():
+        pass
+    compact()
+    # Events still too recent to roll up are taken by the next run.
+    position = RollupCheckpoint.objects.get(name=CHECKPOINT).position
+    if DownloadEvent.objects.filter(id__gt=position).exists():
+        schedule_roll_up()
+
+
+def trending_files(days, queryset, limit=None):
+    """
+    Files of ``queryset`` downloaded most over the last ``days`` days,
+    counted from daily rollups, with the count in ``downloads``.
+    """
+    start = bucket_start(timezone.now(), DownloadRollup.DAY) - timedelta(days=days - 1)
+    top = list(
+        DownloadRollup.objects.filter(
+            period=DownloadRollup.DAY,
+            bucket__gte=start,
+            file_id__in=queryset.values('id')
+        ).values('file_id').annotate(downloads=Sum('count'))
+        .order_by('-downloads', '-file_id')[:limit or settings.TRENDING_LIMIT]
+    )
+    files = queryset.in_bulk([row['file_id'] for row in top])
+    result = []
+    for row in top:
+        file = files.get(row['file_id'])
+        if file is not None:
+            file.downloads = row['downloads']
+            result.append(file)
+    return result
@@ -0,0 +1,69 @@
+import time
+import zipfile
+
+from .streaming import CHUNK_SIZE
+
+COMPRESSION = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+}
+
+
+class _Sink:
+    """
+    Write-only, unseekable file object collecting what ZipFile writes, so
+    the archive can be handed out piece by piece. ZipFile notices it cannot
+    seek and writes sizes and CRCs in data descriptors after each entry.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(entries, compression=zipfile.ZIP_STORED):
+    """
+    Generate a ZIP archive of ``entries`` incrementally. Each entry is an
+    ``(arcname, size, open_file)`` tuple where ``open_file`` returns a
+    readable binary file. ZIP64 records are used where sizes require them.
+    """
+    sink = _Sink()
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(sink, 'w', compression=compression, allowZip64=True) as archive:
+        for arcname, size, open_file in entries:
+            info = zipfile.ZipInfo(arcname, date_time=date_time)
+            info.compress_type = compression
+            info.file_size = size
+            with open_file() as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    target.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def unique_names(names):
+    seen = set()
+    for name in names:
+        candidate, n = name, 1
+        while candidate in seen:
+            stem, dot, ext = name.rpartition('.')
+            candidate = f'{stem} ({n}).{ext}' if dot else f'{name} ({n})'
+            n += 1
+        seen.add(candidate)
+        yield candidate
@@ -0,0 +1,49 @@
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+from .streaming import RangedFileResponse
+
+
+class FileStreamingASGIHandler(ASGIHandler):
+    """
+    ASGI handler that sends RangedFileResponse bodies without iterating them
+    synchronously on the event loop, which is what Django's own handler does
+    with streaming responses.
+    """
+
+    async def send_response(self, response, send):
+        if not isinstance(response, RangedFileResponse):
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append(
+                (b'Set-Cookie', c.output(header='').encode('ascii').strip())
+            )
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        try:
+            async for chunk in response.aiter_blocks():
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return FileStreamingASGIHandler()
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .routing import follow_user
+
+
+User = get_user_model()
+
+# User fields kept in the cache; the rest, including the password hash,
+# are loaded on access.
+USER_FIELDS = (
+    'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser'
+)
+
+# What is cached per token: plain values, never model instances, so
+# requests cannot share state through them.
+CachedToken = namedtuple('CachedToken', ('user_id', 'created', 'user'))
+
+
+def user_fields():
+    # Model order, as from_db expects.
+    return [
+        field.attname for field in User._meta.concrete_fields
+        if field.primary_key or field.attname in USER_FIELDS
+    ]
+
+
+def cache_entry(token):
+    return CachedToken(
+        token.user_id, token.created,
+        tuple(getattr(token.user, name) for name in user_fields())
+    )
+
+
+def restore(key, entry):
+    """
+    Fresh Token and User instances for a cached entry. Fields that are not
+    cached are deferred, so saving the user only writes the loaded ones.
+    """
+    user = User.from_db(DEFAULT_DB_ALIAS, user_fields(), entry.user)
+    token = Token.from_db(
+        DEFAULT_DB_ALIAS, ['key', 'user_id', 'created'], (key, entry.user_id, entry.created)
+    )
+    token.user = user
+    return token
+
+
+class TokenCache:
+    """
+    Maps token keys to CachedToken entries in an in-process LRU with a TTL,
+    optionally backed by a shared Django cache.
+    Invalidation clears the local LRU and the shared cache; other processes
+    drop their local copies after at most TTL seconds.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return settings.TOKEN_AUTH_CACHE
+
+    @property
+    def shared(self):
+        alias = self.config.get('CACHE_ALIAS')
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def shared_key(key):
+        return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        entry = self._get(key)
+        return restore(key, entry) if entry is not None else None
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, cached = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    return cached
+                del self._entries[key]
+
+        if self.shared is not None:
+            cached = self.shared.get(self.shared_key(key))
+            if cached is not None:
+                self._store(key, cached)
+                return cached
+        return None
+
+    def set(self, key, token):
+        entry = cache_entry(token)
+        self._store(key, entry)
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), entry, self.config['TTL'])
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.config['TTL'], entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.config['MAX_SIZE']:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared is not None and keys:
+            self.shared.delete_many([self.shared_key(key) for key in keys])
+
+    def invalidate_user(self, user_id, keys=()):
+        with self._lock:
+            cached = [
+                key for key, (_, entry) in self._entries.items()
+                if entry.user_id == user_id
+            ]
+        self.invalidate(*set(cached) | set(keys))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that skips the token and user query for tokens
+    seen within the last TOKEN_AUTH_CACHE['TTL'] seconds.
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        follow_user(token.user_id)
+        return token.user, token
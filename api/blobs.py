@@ -0,0 +1,234 @@
+import hashlib
+import os
+import shutil
+from collections import defaultdict, namedtuple
+
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .compression import choose_encoding, compress
+from .models import Blob, blob_upload_to
+from .reclaim import enqueue_deletions
+from .streaming import CHUNK_SIZE
+
+
+def content_digest(content):
+    """
+    Return the SHA-256 of an uploaded file, reusing the digest computed by
+    the hashing upload handlers when there is one.
+    """
+    digest = getattr(content, 'sha256', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in content.chunks(CHUNK_SIZE):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        content.seek(0)
+    return digest
+
+
+def path_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def is_local_storage(storage):
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+
+def _save(name, content, encoding=''):
+    if not encoding:
+        return default_storage.save(name, content)
+    with compress(content) as packed:
+        return default_storage.save(name, DjangoFile(packed))
+
+
+def _reference(digest, count=1):
+    blob = Blob.objects.select_for_update().filter(digest=digest).first()
+    if blob is not None:
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + count)
+    return blob
+
+
+def reference_blob(digest, count=1):
+    """
+    Take ``count`` references to the blob of ``digest`` and return it, or
+    None if that content is not stored. Must be called inside a transaction.
+    """
+    return _reference(digest, count)
+
+
+def _create(digest, size, write):
+    """
+    Create a blob row for content that is not stored yet. ``write`` puts
+    the content into storage and returns its name. If a concurrent upload
+    of the same content wins the race, the duplicate is removed and that
+    blob is referenced instead.
+    """
+    blob = Blob(digest=digest, size=size, ref_count=1)
+    name = write(blob)
+    try:
+        with transaction.atomic():
+            blob.file.name = name
+            blob.save()
+    except IntegrityError:
+        default_storage.delete(name)
+        return _reference(digest)
+    return blob
+
+
+def store_blob(content):
+    """
+    Store an uploaded file as a content-addressed blob and take a reference
+    to it. Content that is already stored is not written again.
+    """
+    digest = content_digest(content)
+
+    def write(blob):
+        blob.encoding = choose_encoding(content)
+        return _save(blob_upload_to(blob, None), content, blob.encoding)
+
+    with transaction.atomic():
+        blob = _reference(digest)
+        if blob is None:
+            blob = _create(digest, content.size, write)
+    return blob
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def adopt_blob_file(path):
+    """
+    Like store_blob, but for a complete local file which is hard linked
+    into storage instead of being copied where possible. The file itself is
+    removed once the transaction commits, so a caller that rolls back can
+    still retry with it.
+    """
+    digest = path_digest(path)
+    size = os.path.getsize(path)
+
+    def link(blob):
+        with open(path, 'rb') as source:
+            blob.encoding = choose_encoding(source)
+            if blob.encoding or not is_local_storage(default_storage):
+                return _save(blob_upload_to(blob, None), DjangoFile(source), blob.encoding)
+        name = default_storage.get_available_name(blob_upload_to(blob, None))
+        target = default_storage.path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            raise
+        except OSError:
+            # Another file system, or one without hard links.
+            shutil.copyfile(path, target)
+        return name
+
+    with transaction.atomic():
+        blob = _reference(digest)
+        if blob is None:
+            blob = _create(digest, size, link)
+        transaction.on_commit(lambda: _remove(path))
+    return blob
+
+
+def discard_unsaved_blob(blob):
+    """
+    Queue the file of ``blob`` for reclamation after the transaction that
+    stored it rolled back. Call it outside that transaction; reclaim keeps
+    the file if a Blob row still refers to it.
+    """
+    enqueue_deletions([blob.file.name])
+
+
+StagedBlob = namedtuple('StagedBlob', ('digest', 'size', 'encoding', 'name'))
+
+
+def stage_blob(content, digest):
+    """
+    Write content next to its content-addressed location under a name
+    nothing else uses. A file already at that location is never reused: it
+    may be queued for reclamation or left half-written by a failed upload.
+    Only touches storage, so it can run in worker threads; the result is
+    turned into a Blob row by register_staged_blob.
+    """
+    encoding = choose_encoding(content)
+    name = default_storage.get_available_name(
+        blob_upload_to(Blob(digest=digest, encoding=encoding), None)
+    )
+    try:
+        name = _save(name, content, encoding)
+    except Exception:
+        default_storage.delete(name)
+        raise
+    return StagedBlob(digest, content.size, encoding, name)
+
+
+def register_staged_blob(staged, count=1):
+    """
+    Take ``count`` references to the blob of a staged file, creating the
+    Blob row if needed. Must be called inside a transaction.
+    """
+    blob = _reference(staged.digest, count)
+    if blob is None:
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.create(
+                    digest=staged.digest,
+                    file=staged.name,
+                    size=staged.size,
+                    encoding=staged.encoding,
+                    ref_count=count
+                )
+        except IntegrityError:
+            blob = _reference(staged.digest, count)
+    if blob.file.name != staged.name:
+        enqueue_deletions([staged.name])
+    return blob
+
+
+def discard_staged_blobs(staged):
+    for item in staged:
+        default_storage.delete(item.name)
+
+
+def release_blobs(counts):
+    """
+    Drop references to blobs, given as ``{blob_id: count}``. Blobs nothing
+    refers to any more are deleted and their files queued for reclamation.
+    Returns the ids of deleted blobs.
+    """
+    by_count = defaultdict(list)
+    for blob_id, count in counts.items():
+        by_count[count].append(blob_id)
+
+    with transaction.atomic():
+        for count, ids in by_count.items():
+            Blob.objects.filter(pk__in=ids).update(ref_count=F('ref_count') - count)
+        unreferenced = list(
+            Blob.objects.select_for_update()
+            .filter(pk__in=counts.keys(), ref_count__lte=0)
+            .values_list('pk', 'file')
+        )
+        if unreferenced:
+            Blob.objects.filter(pk__in=[pk for pk, _ in unreferenced]).delete()
+            enqueue_deletions([name for _, name in unreferenced])
+    return [pk for pk, _ in unreferenced]
+
+
+def release_blob(blob_id):
+    return bool(release_blobs({blob_id: 1}))
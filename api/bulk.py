@@ -0,0 +1,161 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from .access import PUBLIC, WRITE, access_filter
+from .blobs import (
+    content_digest, discard_staged_blobs, reference_blob, register_staged_blob,
+    release_blobs, stage_blob
+)
+from .list_cache import invalidate
+from .models import Blob, File, guess_content_type, make_token
+from .reclaim import enqueue_deletions
+from .pipeline import start_processing
+from .search import index_files, unindex_files
+from .signing import forget_versions
+from .usage import charge, check_quota, release
+
+DELETE_BATCH_SIZE = 500
+
+
+def _capture(function):
+    def wrapper(*args):
+        try:
+            return function(*args)
+        except Exception as e:
+            return e
+    return wrapper
+
+
+def bulk_upload(author, contents, access='only_author'):
+    """
+    Store many uploaded files at once. Hashing and writing run in a bounded
+    thread pool, then all blob references and File rows are saved in one
+    transaction with bulk_create. Returns one result dict per file; files
+    that could not be written are reported with an ``error``. If the
+    transaction fails, every blob written by this call is removed again.
+    """
+    check_quota(author.pk, sum(content.size for content in contents))
+    with ThreadPoolExecutor(max_workers=settings.BULK_UPLOAD_WORKERS) as executor:
+        digests = list(executor.map(_capture(content_digest), contents))
+        # Identical files in one request are written only once.
+        unique = {}
+        for content, digest in zip(contents, digests):
+            if not isinstance(digest, Exception):
+                unique.setdefault(digest, content)
+        # Content stored already is only referenced, not written again.
+        stored = set(
+            Blob.objects.filter(digest__in=list(unique)).values_list('digest', flat=True)
+        )
+        new = [digest for digest in unique if digest not in stored]
+        staged = dict(zip(
+            new,
+            executor.map(_capture(stage_blob), [unique[digest] for digest in new], new)
+        ))
+
+    results = []
+    pending = []
+    for content, digest in zip(contents, digests):
+        error = digest if isinstance(digest, Exception) else staged.get(digest)
+        if isinstance(error, Exception):
+            results.append({'name': content.name, 'error': str(error)})
+        else:
+            results.append({'name': content.name})
+            pending.append((results[-1], content, digest))
+
+    written = [item for item in staged.values() if not isinstance(item, Exception)]
+    try:
+        with transaction.atomic():
+            counts = Counter(digest for _, _, digest in pending)
+            blobs = {}
+            for digest, count in counts.items():
+                blob = None if digest in staged else reference_blob(digest, count)
+                if blob is None:
+                    if digest not in staged:
+                        # Released since it was looked up.
+                        staged[digest] = stage_blob(unique[digest], digest)
+                        written.append(staged[digest])
+                    blob = register_staged_blob(staged[digest], count)
+                blobs[digest] = blob
+            files = [
+                File(
+                    author=author,
+                    access=access,
+                    blob=blobs[digest],
+                    file=blobs[digest].file.name,
+                    token=make_token(content.name),
+                    name=content.name[:255],
+                    size=content.size,
+                    content_type=guess_content_type(content.name, content.content_type)
+                )
+                for _, content, digest in pending
+            ]
+            if files:
+                charge(author.pk, sum(file.size for file in files), len(files))
+            File.objects.bulk_create(files)
+            if files and files[0].pk is None:
+                # Backends that cannot return ids from a bulk insert.
+                ids = dict(
+                    File.objects.filter(token__in=[f.token for f in files])
+                    .values_list('token', 'id')
+                )
+                for file in files:
+                    file.pk = ids[file.token]
+            start_processing(files)
+            index_files(files)
+            if files:
+                invalidate([author.pk], public=access == PUBLIC)
+    except Exception:
+        discard_staged_blobs(written)
+        raise
+
+    for (result, _, _), file in zip(pending, files):
+        result.update(id=file.pk, token=file.token, access=file.access)
+    return results
+
+
+def delete_files(queryset):
+    """
+    Delete the File rows of ``queryset``, releasing their blobs and
+    queueing files nothing refers to any more for reclamation. The rows are
+    locked first and everything is released for exactly the rows locked,
+    so concurrent deletes of the same files release them only once. Must be
+    called inside a transaction. Returns the ids of deleted files.
+    """
+    rows = list(queryset.select_for_update().values_list(
+        'id', 'author_id', 'access', 'size', 'blob_id', 'file'
+    ))
+    if not rows:
+        return []
+    ids = [pk for pk, *_ in rows]
+    usage = {}
+    for _, author_id, _, size, _, _ in rows:
+        total, count = usage.get(author_id, (0, 0))
+        usage[author_id] = (total + size, count + 1)
+
+    invalidate(usage, public=any(access == PUBLIC for _, _, access, *_ in rows))
+    File.objects.filter(pk__in=ids).delete()
+    unindex_files(ids)
+    release(usage)
+    transaction.on_commit(lambda: forget_versions(ids))
+    release_blobs(Counter(blob_id for *_, blob_id, _ in rows if blob_id is not None))
+    enqueue_deletions([name for *_, blob_id, name in rows if blob_id is None])
+    return ids
+
+
+def bulk_delete(user, ids):
+    """
+    Delete the files among ``ids`` that ``user`` may delete, in one
+    transaction. Stored files are removed later by the reclaim_blobs
+    command. Returns the ids of deleted files.
+    """
+    deleted = []
+    with transaction.atomic():
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            deleted += delete_files(File.objects.filter(
+                access_filter(WRITE, user),
+                id__in=ids[start:start + DELETE_BATCH_SIZE]
+            ))
+    return deleted
@@ -0,0 +1,102 @@
+import gzip
+import shutil
+import tempfile
+
+from django.conf import settings
+
+GZIP = 'gzip'
+
+# Magic numbers of formats that are compressed already.
+COMPRESSED_SIGNATURES = (
+    b'\x1f\x8b',                # gzip
+    b'PK\x03\x04',              # zip, docx, xlsx, jar, apk
+    b'\x89PNG',
+    b'\xff\xd8\xff',            # jpeg
+    b'GIF8',
+    b'BZh',
+    b'\xfd7zXZ\x00',
+    b'7z\xbc\xaf\x27\x1c',
+    b'Rar!',
+    b'\x28\xb5\x2f\xfd',        # zstd
+    b'OggS',
+    b'fLaC',
+    b'ID3',                     # mp3
+)
+
+
+def choose_encoding(fileobj):
+    """
+    Decide how to store a file: gzip when at-rest compression is enabled,
+    the content is not a known compressed format and a sample from its
+    start compresses well enough; otherwise '' (stored as is).
+    """
+    if not settings.COMPRESS_AT_REST:
+        return ''
+    fileobj.seek(0)
+    sample = fileobj.read(settings.COMPRESS_SAMPLE_SIZE)
+    fileobj.seek(0)
+    if len(sample) < settings.COMPRESS_MIN_SIZE:
+        return ''
+    if sample.startswith(COMPRESSED_SIGNATURES) or sample[4:8] in (b'ftyp', b'moov'):
+        return ''
+    if sample.startswith(b'RIFF') and sample[8:12] in (b'WEBP', b'AVI '):
+        return ''
+    ratio = len(gzip.compress(sample, compresslevel=1)) / len(sample)
+    return GZIP if ratio <= settings.COMPRESS_MAX_RATIO else ''
+
+
+def compress(fileobj):
+    """
+    Return a temporary file holding the gzip-compressed content of
+    ``fileobj``, written block by block.
+    """
+    packed = tempfile.TemporaryFile()
+    fileobj.seek(0)
+    with gzip.GzipFile(fileobj=packed, mode='wb', compresslevel=settings.COMPRESS_LEVEL, mtime=0) as target:
+        shutil.copyfileobj(fileobj, target)
+    packed.seek(0)
+    return packed
+
+
+class DecodedFile:
+    """
+    Read-only file object decompressing a stored gzip file on the fly.
+    Seeking forward decompresses and discards the skipped data.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.decoded = gzip.GzipFile(fileobj=raw, mode='rb')
+
+    def read(self, size=-1):
+        return self.decoded.read(size)
+
+    def seek(self, offset, whence=0):
+        return self.decoded.seek(offset, whence)
+
+    def close(self):
+        self.decoded.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_decoded(storage, name, encoding=''):
+    raw = storage.open(name, 'rb')
+    return DecodedFile(raw) if encoding == GZIP else raw
+
+
+def accepts_encoding(request, encoding):
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() in (encoding, '*'):
+            q = params.strip()
+            try:
+                return float(q[2:]) > 0 if q.startswith('q=') else True
+            except ValueError:
+                return False
+    return False
@@ -0,0 +1,113 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCounter:
+    """
+    Collects download increments in process and writes them in batches as
+    ``download_count = download_count + n`` updates, one UPDATE per distinct
+    increment, together with DownloadEvent rows for analytics. Increments
+    that fail to flush are put back, and whatever is still pending is
+    flushed when the process exits.
+    """
+
+    def __init__(self):
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def incr(self, file_id, count=1):
+        self.incr_many({file_id: count})
+
+    def incr_many(self, counts):
+        with self._lock:
+            self._pending.update(counts)
+            pending = sum(self._pending.values())
+
+        interval = settings.DOWNLOAD_COUNTER_FLUSH_INTERVAL
+        if interval <= 0 or pending >= settings.DOWNLOAD_COUNTER_MAX_PENDING:
+            # Called while serving a download, which must not fail because
+            # the counters could not be written; flush keeps the increments
+            # for the next attempt.
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush download counters')
+        if interval > 0:
+            self._ensure_thread()
+
+    def flush(self):
+        from .analytics import record, schedule_roll_up
+        from .list_cache import invalidate_files
+        from .models import File
+
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        by_delta = defaultdict(list)
+        for file_id, count in pending.items():
+            by_delta[count].append(file_id)
+
+        try:
+            with transaction.atomic():
+                for count, ids in by_delta.items():
+                    File.objects.filter(id__in=ids).update(
+                        download_count=F('download_count') + count
+                    )
+                record(pending)
+                schedule_roll_up()
+                # Lists are ordered by download count.
+                invalidate_files(File.objects.filter(id__in=list(pending)))
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return sum(pending.values())
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name='download-counter-flusher',
+                    daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(settings.DOWNLOAD_COUNTER_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush download counters')
+            finally:
+                connections.close_all()
+
+    def shutdown(self):
+        self._stopped.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush download counters on shutdown')
+
+
+download_counter = DownloadCounter()
+atexit.register(download_counter.shutdown)
@@ -0,0 +1,210 @@
+"""
+A small job queue kept in the database, so work can leave the request path
+without an external broker. Jobs are enqueued in the transaction of the
+change that needs them and run by ``manage.py run_jobs``.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job name -> (handler, on_failure)
+registry = {}
+
+
+def job(name, on_failure=None):
+    """
+    Register a handler, called with the job payload as keyword arguments.
+    ``on_failure`` is called the same way once the job has used up all of
+    its attempts.
+    """
+    def register(handler):
+        registry[name] = (handler, on_failure)
+        return handler
+    return register
+
+
+def enqueue(name, payloads, max_attempts=None, run_at=None):
+    """
+    Queue one job of ``name`` per payload. Returns the created jobs.
+    """
+    if name not in registry:
+        raise KeyError(f'Unknown job {name!r}.')
+    return Job.objects.bulk_create([
+        Job(
+            name=name,
+            payload=payload,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_at=run_at or timezone.now()
+        )
+        for payload in payloads
+    ])
+
+
+def requeue_stale(now=None):
+    """
+    Put back jobs whose worker stopped without finishing them.
+    """
+    now = now or timezone.now()
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    ).update(status=Job.QUEUED, locked_by='', locked_at=None)
+
+
+def prune_finished(now=None, batch_size=1000):
+    """
+    Delete done and failed jobs that finished more than JOB_RETENTION
+    seconds ago, in batches. Returns the number of jobs deleted.
+    """
+    if settings.JOB_RETENTION is None:
+        return 0
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.JOB_RETENTION)
+    finished = Job.objects.filter(status__in=(Job.DONE, Job.FAILED), finished_at__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(finished.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Job.objects.filter(pk__in=ids).delete()[0]
+
+
+def _prune():
+    try:
+        prune_finished()
+    except Exception:
+        logger.exception('Pruning finished jobs failed')
+
+
+def claim(worker, now=None):
+    """
+    Take the next due job for ``worker``, or return None. The job is only
+    taken if it is still queued when marked running, so workers racing for
+    it never both run it.
+    """
+    now = now or timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = due.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.RUNNING, locked_by=worker, locked_at=now,
+                attempts=F('attempts') + 1
+            )
+    else:
+        for job in due[:10]:
+            taken = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_by=worker, locked_at=now,
+                attempts=F('attempts') + 1
+            )
+            if taken:
+                break
+        else:
+            return None
+    job.refresh_from_db()
+    return job
+
+
+def run(job):
+    """
+    Run a claimed job and record the outcome. Failed jobs are retried with
+    exponential backoff until they reach ``max_attempts``.
+    """
+    handler, on_failure = registry.get(job.name, (None, None))
+    try:
+        if handler is None:
+            raise KeyError(f'Unknown job {job.name!r}.')
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed', job.pk, job.name, exc_info=True)
+        if job.attempts < job.max_attempts:
+            delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, locked_by='', locked_at=None, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=delay)
+            )
+            return Job.QUEUED
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.FAILED, last_error=error, finished_at=timezone.now()
+        )
+        if on_failure is not None:
+            try:
+                on_failure(**job.payload)
+            except Exception:
+                logger.exception('Failure handler of job %s failed', job.pk)
+        return Job.FAILED
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return Job.DONE
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def work(stop, interval=1, burst=False):
+    """
+    Claim and run jobs until ``stop`` is set; with ``burst`` also stop as
+    soon as no job is due. Returns the number of jobs run.
+    """
+    name = worker_name()
+    count = 0
+    while not stop.is_set():
+        job = claim(name)
+        if job is None:
+            if burst:
+                break
+            stop.wait(interval)
+            continue
+        run(job)
+        count += 1
+    return count
+
+
+def _work_in_thread(*args):
+    try:
+        return work(*args)
+    finally:
+        connection.close()
+
+
+def run_workers(concurrency=None, interval=1, burst=False, stop=None):
+    """
+    Run ``concurrency`` worker threads until ``stop`` is set (or, with
+    ``burst``, until the queue is drained). Finished jobs are pruned every
+    JOB_PRUNE_INTERVAL seconds meanwhile. Returns the number of jobs run.
+    """
+    concurrency = concurrency or settings.JOB_CONCURRENCY
+    stop = stop or threading.Event()
+    requeue_stale()
+    _prune()
+    pruned_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(_work_in_thread, stop, interval, burst)
+            for _ in range(concurrency)
+        ]
+        try:
+            while not all(future.done() for future in futures):
+                if time.monotonic() - pruned_at >= settings.JOB_PRUNE_INTERVAL:
+                    _prune()
+                    pruned_at = time.monotonic()
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            stop.set()
+    return sum(future.result() for future in futures)
@@ -0,0 +1,158 @@
+"""
+Cache of file list pages.
+
+Pages are cached per visibility scope: anonymous users see public files,
+authenticated users public files and their own. Keys include the current
+version of every scope a page depends on, so changing files only bumps
+versions and stale pages simply stop being read until they expire.
+Versions are bumped both when a change is made and after its transaction
+commits; pages read the versions before querying, so a page built from
+rows read before the commit is never stored under the final version.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import urlencode
+
+from .access import PUBLIC
+from .routing import reading_replicas
+
+# Bumped for changes that may affect any page, such as moved files.
+ALL = 'all'
+PUBLIC_SCOPE = 'public'
+
+HITS = 'api.list_cache.stats:hits'
+MISSES = 'api.list_cache.stats:misses'
+
+
+def _cache():
+    return caches[settings.FILE_LIST_CACHE['CACHE_ALIAS']]
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def _version_key(scope):
+    return f'api.list_cache.version:{scope}'
+
+
+def _new_version():
+    # Versions start from the clock, so a version re-created after being
+    # evicted never matches pages stored under the lost one.
+    return time.time_ns()
+
+
+def _versions(scopes):
+    cache = _cache()
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def _bump(scopes):
+    cache = _cache()
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _new_version(), None)
+
+
+def invalidate(author_ids=(), public=True):
+    """
+    Drop the cached pages of ``author_ids`` and, with ``public``, those
+    showing public files.
+    """
+    if not settings.FILE_LIST_CACHE['ENABLED']:
+        return
+    scopes = [user_scope(author_id) for author_id in set(author_ids)]
+    if public:
+        scopes.append(PUBLIC_SCOPE)
+    if scopes:
+        _bump(scopes)
+        transaction.on_commit(lambda: _bump(scopes))
+
+
+def invalidate_files(queryset):
+    """
+    Invalidate the pages showing the files of ``queryset``. The files are
+    looked up right away, so call it before deleting them.
+    """
+    if not settings.FILE_LIST_CACHE['ENABLED']:
+        return
+    rows = list(queryset.values_list('author_id', 'access').distinct())
+    invalidate(
+        (author_id for author_id, _ in rows),
+        public=any(access == PUBLIC for _, access in rows)
+    )
+
+
+def invalidate_all():
+    if settings.FILE_LIST_CACHE['ENABLED']:
+        _bump([ALL])
+        transaction.on_commit(lambda: _bump([ALL]))
+
+
+def _count(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_or_build(request, build):
+    """
+    Return the cached list page for ``request``, building it with
+    ``build()`` and caching it on a miss.
+    """
+    config = settings.FILE_LIST_CACHE
+    if not config['ENABLED']:
+        return build()
+
+    scopes = [ALL, PUBLIC_SCOPE]
+    if request.user.is_authenticated:
+        scopes.append(user_scope(request.user.pk))
+    versions = _versions(scopes)
+    # Pages hold absolute links, so the host is part of the key.
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    page = f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+    digest = hashlib.sha1(page.encode()).hexdigest()
+    key = f'api.list_cache.page:{scopes[-1]}:{":".join(map(str, versions))}:{digest}'
+
+    cache = _cache()
+    data = cache.get(key)
+    if data is not None:
+        _count(HITS)
+        return data
+    _count(MISSES)
+    data = build()
+    # A page read from a lagging replica may predate the last bump; keep it
+    # no longer than the lag users are pinned to the primary for.
+    timeout = config['TTL']
+    if reading_replicas():
+        timeout = min(timeout, settings.DATABASE_PIN_SECONDS)
+    cache.set(key, data, timeout)
+    return data
+
+
+def stats():
+    values = _cache().get_many([HITS, MISSES])
+    hits, misses = values.get(HITS, 0), values.get(MISSES, 0)
+    return {
+        'backend': settings.CACHES[settings.FILE_LIST_CACHE['CACHE_ALIAS']]['BACKEND'],
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+    }
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired upload sessions together with their partial files.'
+
+    def handle(self, *args, **options):
+        count = expire_sessions()
+        self.stdout.write(f'Expired {count} upload session(s).')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the file search index from the files table.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(f'Indexed {count} file(s).')
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.reclaim import reclaim
+
+
+class Command(BaseCommand):
+    help = 'Remove files of deleted blobs and files from storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-attempts', type=int, default=None)
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep draining the queue, polling every --interval seconds.'
+        )
+        parser.add_argument('--interval', type=float, default=10)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed, failed = reclaim(options['batch_size'], options['max_attempts'])
+            total += processed - failed
+            if failed:
+                self.stderr.write(f'{failed} deletion(s) failed and will be retried.')
+            if processed == failed:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(f'Reclaimed {total} file(s).')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.usage import reconcile_usage
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user storage usage from stored files and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report users whose usage drifted.'
+        )
+
+    def handle(self, *args, **options):
+        drift = reconcile_usage(fix=not options['dry_run'])
+        for user_id, ((stored_bytes, stored_files), (bytes, files)) in sorted(drift.items()):
+            self.stdout.write(
+                f'User {user_id}: {stored_bytes} bytes in {stored_files} file(s) recorded, '
+                f'{bytes} bytes in {files} file(s) stored.'
+            )
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(f'{verb} drift for {len(drift)} user(s).')
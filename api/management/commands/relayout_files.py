@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import Blob, File
+from api.relayout import relayout
+
+
+class Command(BaseCommand):
+    help = (
+        'Move stored files to the directory layout set by FILE_STORAGE_FANOUT. '
+        'Safe to run while the service is live and to interrupt and restart.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--grace',
+            type=float,
+            default=600,
+            help='Seconds old paths stay readable before reclaim_blobs removes them.'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches to limit the load.'
+        )
+        parser.add_argument('--after-blob', type=int, default=0)
+        parser.add_argument('--after-file', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for model, after in ((Blob, options['after_blob']), (File, options['after_file'])):
+            total = 0
+            while True:
+                after, moved = relayout(
+                    model, after, options['batch_size'], options['grace']
+                )
+                if after is None:
+                    break
+                total += moved
+                self.stdout.write(f'{model.__name__}: moved {total}, last id {after}')
+                time.sleep(options['pause'])
+            self.stdout.write(f'Moved {total} {model._meta.verbose_name_plural.lower()}.')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, such as post-upload processing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Number of worker threads (JOB_CONCURRENCY by default).'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1,
+            help='Seconds an idle worker waits before polling again.'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once no job is due instead of waiting for more.'
+        )
+
+    def handle(self, *args, **options):
+        count = run_workers(options['concurrency'], options['interval'], options['burst'])
+        self.stdout.write(f'Ran {count} job(s).')
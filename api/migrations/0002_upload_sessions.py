@@ -0,0 +1,58 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:12
+
+import api.models
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(unique=True, upload_to=api.models.upload_to, verbose_name='File'),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=1000, verbose_name='File name')),
+                ('access', models.CharField(default='only_author', max_length=50, verbose_name='Access')),
+                ('size', models.BigIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Size')),
+                ('chunk_size', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Chunk size')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL, verbose_name='Author')),
+            ],
+            options={
+                'verbose_name': 'Upload session',
+                'verbose_name_plural': 'Upload sessions',
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Index')),
+                ('size', models.IntegerField(verbose_name='Size')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.uploadsession', verbose_name='Upload session')),
+            ],
+            options={
+                'verbose_name': 'Upload chunk',
+                'verbose_name_plural': 'Upload chunks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='uploadchunk',
+            constraint=models.UniqueConstraint(fields=('session', 'index'), name='unique_upload_chunk'),
+        ),
+    ]
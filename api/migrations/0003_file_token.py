@@ -0,0 +1,35 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_tokens(apps, schema_editor):
+    File = apps.get_model('api', 'File')
+    batch = []
+    files = File.objects.filter(token__isnull=True).only('id', 'file')
+    for file in files.iterator(chunk_size=BATCH_SIZE):
+        file.token = file.file.name.split('/')[-1]
+        batch.append(file)
+        if len(batch) >= BATCH_SIZE:
+            File.objects.bulk_update(batch, ['token'])
+            batch = []
+    if batch:
+        File.objects.bulk_update(batch, ['token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='token',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True, verbose_name='Token'),
+        ),
+        migrations.RunPython(backfill_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:14
+
+import api.models
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_file_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('file', models.FileField(max_length=255, upload_to=api.models.blob_upload_to, verbose_name='File')),
+                ('size', models.BigIntegerField(validators=[django.core.validators.MinValueValidator(0)], verbose_name='Size')),
+                ('ref_count', models.IntegerField(default=0, verbose_name='Reference counter')),
+            ],
+            options={
+                'verbose_name': 'Blob',
+                'verbose_name_plural': 'Blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(max_length=255, upload_to=api.models.upload_to, verbose_name='File'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='api.blob', verbose_name='Blob'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='file',
+            options={'ordering': ['-download_count', '-id'], 'verbose_name': 'File', 'verbose_name_plural': 'Files'},
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['-download_count', '-id'], name='file_download_count_id_idx'),
+        ),
+    ]
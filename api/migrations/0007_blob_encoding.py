@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_pending_deletions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='Content encoding'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_blob_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='link_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Link key version'),
+        ),
+    ]
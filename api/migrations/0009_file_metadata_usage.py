@@ -0,0 +1,82 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:30
+
+import mimetypes
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+import django.utils.timezone
+
+BATCH_SIZE = 1000
+
+
+def backfill_metadata(apps, schema_editor):
+    File = apps.get_model('api', 'File')
+    StorageUsage = apps.get_model('api', 'StorageUsage')
+    batch = []
+    files = File.objects.select_related('blob').only('id', 'file', 'token', 'blob__size')
+    for file in files.iterator(chunk_size=BATCH_SIZE):
+        if file.blob_id is not None:
+            file.size = file.blob.size
+        else:
+            try:
+                file.size = file.file.size
+            except FileNotFoundError:
+                file.size = 0
+        file.content_type = (
+            mimetypes.guess_type(file.token or file.file.name)[0] or 'application/octet-stream'
+        )
+        batch.append(file)
+        if len(batch) >= BATCH_SIZE:
+            File.objects.bulk_update(batch, ['size', 'content_type'])
+            batch = []
+    if batch:
+        File.objects.bulk_update(batch, ['size', 'content_type'])
+
+    StorageUsage.objects.bulk_create(
+        StorageUsage(user_id=row['author_id'], bytes=row['bytes'], files=row['files'])
+        for row in File.objects.values('author_id').annotate(
+            bytes=Sum('size'), files=Count('id')
+        ).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0008_file_link_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('bytes', models.BigIntegerField(default=0, verbose_name='Bytes')),
+                ('files', models.IntegerField(default=0, verbose_name='Files')),
+            ],
+            options={
+                'verbose_name': 'Storage usage',
+                'verbose_name_plural': 'Storage usage',
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='content_type',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='MIME type'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Size'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='uploaded_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Uploaded at'),
+        ),
+        migrations.RunPython(backfill_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:34
+
+import django.core.validators
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_file_metadata_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+                ('payload', models.JSONField(default=dict, verbose_name='Payload')),
+                ('status', models.CharField(default='queued', max_length=20, verbose_name='Status')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('max_attempts', models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Max attempts')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Run at')),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100, verbose_name='Locked by')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='Locked at')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+            ],
+            options={
+                'verbose_name': 'Job',
+                'verbose_name_plural': 'Jobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='processing_status',
+            field=models.CharField(default='ready', max_length=20, verbose_name='Processing status'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Name')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Position')),
+            ],
+            options={
+                'verbose_name': 'Rollup checkpoint',
+                'verbose_name_plural': 'Rollup checkpoints',
+            },
+        ),
+        migrations.CreateModel(
+            name='DownloadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=10, verbose_name='Period')),
+                ('bucket', models.DateTimeField(verbose_name='Bucket start')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('file', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.file', verbose_name='File')),
+            ],
+            options={
+                'verbose_name': 'Download rollup',
+                'verbose_name_plural': 'Download rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='DownloadEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=1, verbose_name='Count')),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Occurred at')),
+                ('file', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.file', verbose_name='File')),
+            ],
+            options={
+                'verbose_name': 'Download event',
+                'verbose_name_plural': 'Download events',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='downloadrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'file'), name='unique_download_rollup'),
+        ),
+    ]
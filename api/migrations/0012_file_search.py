@@ -0,0 +1,70 @@
+# Generated by Django 3.2.5 on 2026-10-18 11:40
+
+import os
+from itertools import islice
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+CREATE_INDEX = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE api_filesearch USING fts5("
+        "name, extension, owner, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    ],
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE TABLE api_filesearch ('
+        'file_id bigint PRIMARY KEY, name varchar(255) NOT NULL, '
+        'extension varchar(255) NOT NULL, owner varchar(150) NOT NULL)',
+        "CREATE INDEX api_filesearch_document_trgm ON api_filesearch "
+        "USING gin ((lower(name || ' ' || owner)) gin_trgm_ops)",
+        'CREATE INDEX api_filesearch_extension ON api_filesearch (extension)',
+    ],
+}
+KEY_COLUMNS = {'sqlite': 'rowid', 'postgresql': 'file_id'}
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_INDEX:
+        return
+    for statement in CREATE_INDEX[vendor]:
+        schema_editor.execute(statement)
+
+    File = apps.get_model('api', 'File')
+    rows = (
+        (pk, '', os.path.splitext(token or '')[1][1:].lower(), username)
+        for pk, token, username in File.objects.values_list('id', 'token', 'author__username')
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    insert = (
+        f'INSERT INTO api_filesearch ({KEY_COLUMNS[vendor]}, name, extension, owner) '
+        'VALUES (%s, %s, %s, %s)'
+    )
+    with schema_editor.connection.cursor() as cursor:
+        # Batches keep memory flat on large tables.
+        for batch in iter(lambda: list(islice(rows, BATCH_SIZE)), []):
+            cursor.executemany(insert, batch)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_INDEX:
+        schema_editor.execute('DROP TABLE api_filesearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_download_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Name'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
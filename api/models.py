@@ -1,17 +1,91 @@
+import mimetypes
 import os
 import uuid
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 
 User = get_user_model()
 
 
-def upload_to(instance, filename):
+def make_token(filename):
     ext = filename.split('.')[-1]
-    filename = uuid.uuid4().hex + '.' + ext
-    return os.path.join(os.path.join('files', str(instance.author.pk)), filename)
+    return uuid.uuid4().hex + '.' + ext
+
+
+def guess_content_type(filename, fallback=None):
+    return mimetypes.guess_type(filename)[0] or fallback or 'application/octet-stream'
+
+
+def sharded_path(directory, name):
+    """
+    Place ``name`` under ``directory`` in nested subdirectories named after
+    its leading characters, as configured by FILE_STORAGE_FANOUT, so no
+    single directory grows too large.
+    """
+    parts, start = [], 0
+    for width in settings.FILE_STORAGE_FANOUT:
+        parts.append(name[start:start + width])
+        start += width
+    return os.path.join(directory, *parts, name)
+
+
+def upload_to(instance, filename):
+    filename = make_token(filename)
+    instance.token = filename
+    return sharded_path(os.path.join('files', str(instance.author.pk)), filename)
+
+
+# File name suffixes of blobs stored compressed.
+ENCODING_SUFFIXES = {'gzip': '.gz'}
+
+
+def blob_upload_to(instance, filename):
+    name = instance.digest + ENCODING_SUFFIXES.get(instance.encoding, '')
+    return sharded_path('blobs', name)
+
+
+class Blob(models.Model):
+    digest = models.CharField(
+        max_length=64,
+        blank=False,
+        null=False,
+        unique=True,
+        verbose_name='SHA-256'
+    )
+    file = models.FileField(
+        blank=False,
+        null=False,
+        upload_to=blob_upload_to,
+        max_length=255,
+        verbose_name='File'
+    )
+    size = models.BigIntegerField(
+        validators=[MinValueValidator(0)],
+        blank=False,
+        null=False,
+        verbose_name='Size'
+    )
+    encoding = models.CharField(
+        max_length=20,
+        blank=True,
+        null=False,
+        default='',
+        verbose_name='Content encoding'
+    )
+    ref_count = models.IntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Reference counter'
+    )
+
+    class Meta:
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
 
 
 class File(models.Model):
@@ -34,8 +108,36 @@ class File(models.Model):
         blank=False,
         null=False,
         upload_to=upload_to,
-        verbose_name='File',
-        unique=True
+        max_length=255,
+        verbose_name='File'
+    )
+    # Uploads made through the API share one stored blob per content
+    # digest; files created without it keep their own path in ``file``.
+    blob = models.ForeignKey(
+        Blob,
+        blank=True,
+        null=True,
+        related_name='files',
+        verbose_name='Blob',
+        on_delete=models.PROTECT
+    )
+    # Public name used in view and download links. It is filled in by
+    # upload_to, so it has to be declared after the file field.
+    token = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        unique=True,
+        editable=False,
+        verbose_name='Token'
+    )
+    # Name the file was uploaded with, shown and searched by.
+    name = models.CharField(
+        max_length=255,
+        blank=True,
+        null=False,
+        default='',
+        verbose_name='Name'
     )
 
     download_count = models.IntegerField(
@@ -45,9 +147,366 @@ class File(models.Model):
         default=0,
         verbose_name='Download counter'
     )
+    # Captured once at upload, so listing files and computing usage never
+    # has to stat stored files.
+    size = models.BigIntegerField(
+        validators=[MinValueValidator(0)],
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Size'
+    )
+    content_type = models.CharField(
+        max_length=255,
+        blank=True,
+        null=False,
+        default='',
+        verbose_name='MIME type'
+    )
+    uploaded_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Uploaded at'
+    )
+    # Progress of the post-upload pipeline run by the job queue.
+    processing_status = models.CharField(
+        max_length=20,
+        blank=False,
+        null=False,
+        default='ready',
+        verbose_name='Processing status'
+    )
+    # Part of the key signed links are made with; bumping it revokes them.
+    link_version = models.PositiveIntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Link key version'
+    )
 
     class Meta:
         verbose_name = 'File'
         verbose_name_plural = 'Files'
 
-        ordering = ['-download_count']
+        ordering = ['-download_count', '-id']
+        indexes = [
+            models.Index(
+                fields=['-download_count', '-id'],
+                name='file_download_count_id_idx'
+            )
+        ]
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False
+    )
+    author = models.ForeignKey(
+        User,
+        blank=False,
+        null=False,
+        related_name='upload_sessions',
+        verbose_name='Author',
+        on_delete=models.CASCADE
+    )
+    filename = models.CharField(
+        max_length=1000,
+        blank=False,
+        null=False,
+        verbose_name='File name'
+    )
+    access = models.CharField(
+        max_length=50,
+        blank=False,
+        null=False,
+        default='only_author',
+        verbose_name='Access'
+    )
+    size = models.BigIntegerField(
+        validators=[MinValueValidator(1)],
+        blank=False,
+        null=False,
+        verbose_name='Size'
+    )
+    chunk_size = models.IntegerField(
+        validators=[MinValueValidator(1)],
+        blank=False,
+        null=False,
+        verbose_name='Chunk size'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created at'
+    )
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name='Expires at'
+    )
+
+    @property
+    def chunk_count(self):
+        return -(-self.size // self.chunk_size)
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{self.id.hex}.part')
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    class Meta:
+        verbose_name = 'Upload session'
+        verbose_name_plural = 'Upload sessions'
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(
+        UploadSession,
+        related_name='chunks',
+        verbose_name='Upload session',
+        on_delete=models.CASCADE
+    )
+    index = models.IntegerField(
+        validators=[MinValueValidator(0)],
+        verbose_name='Index'
+    )
+    size = models.IntegerField(
+        verbose_name='Size'
+    )
+
+    class Meta:
+        verbose_name = 'Upload chunk'
+        verbose_name_plural = 'Upload chunks'
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session', 'index'],
+                name='unique_upload_chunk'
+            )
+        ]
+
+
+class PendingDeletion(models.Model):
+    path = models.CharField(
+        max_length=255,
+        blank=False,
+        null=False,
+        verbose_name='Path'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created at'
+    )
+    attempts = models.IntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Attempts'
+    )
+    next_attempt_at = models.DateTimeField(
+        db_index=True,
+        default=timezone.now,
+        verbose_name='Next attempt at'
+    )
+    last_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='Last error'
+    )
+
+    class Meta:
+        verbose_name = 'Pending deletion'
+        verbose_name_plural = 'Pending deletions'
+
+
+class StorageUsage(models.Model):
+    """
+    Running totals of the files a user stores, kept up to date in the
+    transactions creating and deleting files.
+    """
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name='storage_usage',
+        verbose_name='User',
+        on_delete=models.CASCADE
+    )
+    bytes = models.BigIntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Bytes'
+    )
+    files = models.IntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Files'
+    )
+
+    class Meta:
+        verbose_name = 'Storage usage'
+        verbose_name_plural = 'Storage usage'
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    name = models.CharField(
+        max_length=100,
+        blank=False,
+        null=False,
+        verbose_name='Name'
+    )
+    payload = models.JSONField(
+        default=dict,
+        verbose_name='Payload'
+    )
+    status = models.CharField(
+        max_length=20,
+        blank=False,
+        null=False,
+        default=QUEUED,
+        verbose_name='Status'
+    )
+    attempts = models.IntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Attempts'
+    )
+    max_attempts = models.IntegerField(
+        validators=[MinValueValidator(1)],
+        blank=False,
+        null=False,
+        default=1,
+        verbose_name='Max attempts'
+    )
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Run at'
+    )
+    locked_by = models.CharField(
+        max_length=100,
+        blank=True,
+        null=False,
+        default='',
+        verbose_name='Locked by'
+    )
+    locked_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Locked at'
+    )
+    last_error = models.TextField(
+        blank=True,
+        null=False,
+        default='',
+        verbose_name='Last error'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Created at'
+    )
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Finished at'
+    )
+
+    class Meta:
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_at_idx')
+        ]
+
+
+class DownloadEvent(models.Model):
+    """
+    Append-only log of downloads, written in batches by the download
+    counter and rolled up into DownloadRollup.
+    """
+    file = models.ForeignKey(
+        File,
+        related_name='+',
+        verbose_name='File',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+    count = models.IntegerField(
+        blank=False,
+        null=False,
+        default=1,
+        verbose_name='Count'
+    )
+    occurred_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Occurred at'
+    )
+
+    class Meta:
+        verbose_name = 'Download event'
+        verbose_name_plural = 'Download events'
+
+
+class DownloadRollup(models.Model):
+    HOUR = 'hour'
+    DAY = 'day'
+
+    file = models.ForeignKey(
+        File,
+        related_name='+',
+        verbose_name='File',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+    period = models.CharField(
+        max_length=10,
+        blank=False,
+        null=False,
+        verbose_name='Period'
+    )
+    bucket = models.DateTimeField(
+        verbose_name='Bucket start'
+    )
+    count = models.IntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Count'
+    )
+
+    class Meta:
+        verbose_name = 'Download rollup'
+        verbose_name_plural = 'Download rollups'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['period', 'bucket', 'file'],
+                name='unique_download_rollup'
+            )
+        ]
+
+
+class RollupCheckpoint(models.Model):
+    name = models.CharField(
+        max_length=50,
+        primary_key=True,
+        verbose_name='Name'
+    )
+    # Id of the last event included in the rollups.
+    position = models.BigIntegerField(
+        blank=False,
+        null=False,
+        default=0,
+        verbose_name='Position'
+    )
+
+    class Meta:
+        verbose_name = 'Rollup checkpoint'
+        verbose_name_plural = 'Rollup checkpoints'
@@ -1,5 +1,128 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class VariablePageSizePaginator(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetPaginator(BasePagination):
+    """
+    Cursor pagination over the ``(-download_count, -id)`` ordering. Pages
+    are fetched with a ``WHERE (download_count, id) < cursor`` condition
+    instead of an OFFSET, so deep pages cost the same as the first one, and
+    the total is only counted when ``count=true`` is passed.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.FILE_LIST_PAGE_SIZE
+        return max(1, min(page_size, settings.FILE_LIST_MAX_PAGE_SIZE))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            download_count, pk, reverse = urlsafe_b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii').split(',')
+            return int(download_count), int(pk), reverse == '1'
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, item, reverse):
+        download_count, pk = self.position(item)
+        cursor = urlsafe_b64encode(
+            f'{download_count},{pk},{int(reverse)}'.encode('ascii')
+        ).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    @staticmethod
+    def position(item):
+        if isinstance(item, Mapping):
+            return item['download_count'], item['id']
+        return item.download_count, item.id
+
+    def paginate_queryset(self, queryset, request, view=None):
+        query_params = request.query_params
+        plain = (self.cursor_query_param not in query_params and
+                 self.page_size_query_param not in query_params)
+        self.page_size = self.get_page_size(request)
+        # The total is only computed for the page that asked for it.
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.count_query_param
+        )
+        self.count = None
+        if query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[2]
+        if cursor is None:
+            queryset = queryset.order_by('-download_count', '-id')
+        elif not reverse:
+            download_count, pk, _ = cursor
+            queryset = queryset.filter(
+                Q(download_count__lt=download_count) |
+                Q(download_count=download_count, id__lt=pk)
+            ).order_by('-download_count', '-id')
+        else:
+            download_count, pk, _ = cursor
+            queryset = queryset.filter(
+                Q(download_count__gt=download_count) |
+                Q(download_count=download_count, id__gt=pk)
+            ).order_by('download_count', 'id')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        # Existing clients get a plain list without parameters as long as it
+        # fits on one page; longer lists come as the first page, with a
+        # link to the next one.
+        self.plain = plain and not self.has_next
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.plain:
+            return Response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
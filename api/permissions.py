@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .access import READ, WRITE, can
+
 
 class RegistrationPermission(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -15,14 +17,7 @@ class FilePermissions(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
-            return (
-                obj.access == 'public' or
-                request.user.is_authenticated and
-                request.user == obj.author
-            )
+            return can(READ, request.user, obj)
 
-        if request.method in ('PATCH', 'DELETE'):
-            return (
-                request.user.is_authenticated and
-                request.user == obj.author
-            )
+        if request.method in ('PATCH', 'DELETE', 'POST'):
+            return can(WRITE, request.user, obj)
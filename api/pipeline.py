@@ -0,0 +1,114 @@
+"""
+Post-upload processing. Uploads only store the file and queue a
+``file.process`` job; the stages listed in FILE_PIPELINE_STAGES then run
+in order in the job worker, and ``File.processing_status`` tells clients
+how far it got.
+"""
+import hashlib
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .compression import open_decoded
+from .access import PUBLIC
+from .jobs import enqueue, job
+from .list_cache import invalidate, invalidate_files
+from .models import File
+from .previews import get_preview
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+READY = 'ready'
+FAILED = 'failed'
+
+# Leading bytes of formats worth telling apart from their file name.
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'PK\x03\x04', 'application/zip'),
+)
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+def verify_checksum(file):
+    """
+    Re-read the stored content and check it against the blob digest.
+    """
+    if file.blob_id is None:
+        return
+    hasher = hashlib.sha256()
+    with open_decoded(file.file.storage, file.file.name, file.blob.encoding) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    if hasher.hexdigest() != file.blob.digest:
+        raise ChecksumMismatch(f'Stored content of file {file.pk} does not match its digest.')
+
+
+def detect_content_type(file):
+    """
+    Replace the MIME type guessed from the file name by the one its content
+    shows, for the formats in SIGNATURES.
+    """
+    encoding = file.blob.encoding if file.blob_id is not None else ''
+    with open_decoded(file.file.storage, file.file.name, encoding) as f:
+        head = f.read(16)
+    if head[8:12] == b'WEBP' and head.startswith(b'RIFF'):
+        detected = 'image/webp'
+    else:
+        detected = next((t for signature, t in SIGNATURES if head.startswith(signature)), None)
+    if detected and detected != file.content_type:
+        file.content_type = detected
+        File.objects.filter(pk=file.pk).update(content_type=detected)
+
+
+def render_previews(file):
+    """
+    Render the PREVIEW_EAGER_SIZES previews, so the first request for them
+    finds them cached.
+    """
+    for size in settings.PREVIEW_EAGER_SIZES:
+        get_preview(file, size)
+
+
+def stages():
+    return [import_string(path) for path in settings.FILE_PIPELINE_STAGES]
+
+
+def start_processing(files):
+    """
+    Queue processing of new files. Call it in the transaction creating
+    them, so jobs exist exactly for committed files.
+    """
+    if not files or not settings.FILE_PIPELINE_STAGES:
+        return
+    ids = [file.pk for file in files]
+    File.objects.filter(pk__in=ids).update(processing_status=PENDING)
+    for file in files:
+        file.processing_status = PENDING
+    enqueue('file.process', [{'file_id': pk} for pk in ids])
+
+
+def _processing_failed(file_id):
+    File.objects.filter(pk=file_id).update(processing_status=FAILED)
+    invalidate_files(File.objects.filter(pk=file_id))
+
+
+@job('file.process', on_failure=_processing_failed)
+def process_file(file_id):
+    file = File.objects.select_related('blob').filter(pk=file_id).first()
+    if file is None:
+        # Deleted before it was processed.
+        return
+    File.objects.filter(pk=file_id).update(processing_status=PROCESSING)
+    invalidate([file.author_id], public=file.access == PUBLIC)
+    for stage in stages():
+        stage(file)
+    File.objects.filter(pk=file_id).update(processing_status=READY)
+    invalidate([file.author_id], public=file.access == PUBLIC)
@@ -0,0 +1,107 @@
+"""
+Preview rendering run in worker processes.
+
+Kept free of Django imports so spawned workers start quickly and never
+touch the database. Pillow renders images and PyMuPDF renders PDFs; both
+are optional and their kinds are only offered when installed.
+"""
+import gzip
+import io
+import os
+from importlib.util import find_spec
+
+IMAGE = 'image'
+PDF = 'pdf'
+TEXT = 'text'
+
+EXTENSIONS = {IMAGE: 'jpg', PDF: 'jpg', TEXT: 'txt'}
+CONTENT_TYPES = {IMAGE: 'image/jpeg', PDF: 'image/jpeg', TEXT: 'text/plain; charset=utf-8'}
+
+TEXT_TYPES = ('application/json', 'application/xml', 'application/javascript')
+
+HAS_PILLOW = find_spec('PIL') is not None
+HAS_PYMUPDF = find_spec('fitz') is not None
+
+
+def preview_kind(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type.startswith('image/') and content_type != 'image/svg+xml':
+        return IMAGE if HAS_PILLOW else None
+    if content_type == 'application/pdf':
+        return PDF if HAS_PYMUPDF and HAS_PILLOW else None
+    if content_type.startswith('text/') or content_type in TEXT_TYPES:
+        return TEXT
+    return None
+
+
+def _open(source, encoding):
+    return gzip.open(source, 'rb') if encoding == 'gzip' else open(source, 'rb')
+
+
+def _save_jpeg(image, size, target):
+    from PIL import Image
+
+    image.thumbnail((size, size))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.save(target, 'JPEG', quality=85, optimize=True)
+
+
+def _render_image(source, size, target):
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image.draft('RGB', (size, size))
+        _save_jpeg(ImageOps.exif_transpose(image), size, target)
+
+
+def _render_pdf(source, size, target):
+    import fitz
+    from PIL import Image
+
+    with fitz.open(stream=source.read(), filetype='pdf') as document:
+        page = document[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    image = Image.open(io.BytesIO(pixmap.tobytes('png')))
+    _save_jpeg(image, size, target)
+
+
+def _render_text(source, limit, target):
+    data = source.read(limit + 1)
+    if len(data) > limit:
+        data = data[:limit]
+        # Prefer ending on a whole line.
+        cut = data.rfind(b'\n')
+        if cut > limit // 2:
+            data = data[:cut + 1]
+    target.write(data.decode('utf-8', errors='ignore').encode())
+
+
+def render(source_path, encoding, kind, size, target_path):
+    """
+    Write a preview of the file at ``source_path`` to ``target_path``:
+    a JPEG at most ``size`` pixels on its longer side for images and the
+    first PDF page, the first ``size`` bytes of text. The target appears
+    atomically, so readers never see a partial preview.
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    partial = f'{target_path}.{os.getpid()}.part'
+    try:
+        with _open(source_path, encoding) as source, open(partial, 'wb') as target:
+            if kind == IMAGE:
+                _render_image(source, size, target)
+            elif kind == PDF:
+                _render_pdf(source, size, target)
+            else:
+                _render_text(source, size, target)
+        os.replace(partial, target_path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return target_path
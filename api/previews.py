@@ -0,0 +1,163 @@
+import atexit
+import gzip
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+from .blobs import is_local_storage
+from .compression import GZIP
+from .models import guess_content_type
+from .preview_render import CONTENT_TYPES, EXTENSIONS, TEXT, preview_kind, render
+
+logger = logging.getLogger(__name__)
+
+PreviewFile = namedtuple('PreviewFile', ('storage', 'name', 'content_type'))
+
+
+class PreviewPending(Exception):
+    pass
+
+
+def preview_storage():
+    return FileSystemStorage(
+        location=settings.PREVIEW_ROOT or os.path.join(settings.MEDIA_ROOT, 'previews')
+    )
+
+
+def _plan(file, size):
+    """
+    Return the kind, effective size and cache name of a preview of
+    ``file``, or None if it has none. Previews of blobs are keyed by
+    digest, so files sharing content share previews.
+    """
+    kind = preview_kind(file.content_type or guess_content_type(file.token or file.file.name))
+    if kind is None:
+        return None
+    if kind == TEXT:
+        size = settings.PREVIEW_TEXT_BYTES
+    key = file.blob.digest if file.blob_id is not None else f'file-{file.pk}'
+    return kind, size, os.path.join(key[:2], f'{key}-{size}.{EXTENSIONS[kind]}')
+
+
+def _copy_source(file, kind, size, encoding):
+    """
+    Copy the stored file to a temporary local file for rendering and return
+    its path and encoding. Text previews only need the first ``size``
+    bytes, so only those are copied, decoded.
+    """
+    copy = tempfile.NamedTemporaryFile(suffix='.preview-source', delete=False)
+    with copy, file.file.storage.open(file.file.name, 'rb') as stored:
+        if kind == TEXT:
+            source = gzip.GzipFile(fileobj=stored) if encoding == GZIP else stored
+            copy.write(source.read(size + 1))
+            encoding = ''
+        else:
+            shutil.copyfileobj(stored, copy)
+    return copy.name, encoding
+
+
+class PreviewGenerator:
+    """
+    Renders previews in a pool of worker processes, so decoding large
+    images and PDFs neither blocks the GIL nor grows the web process.
+    Requests for a preview that is already being rendered wait for the
+    same job. Sources on non-local storage are copied before submitting,
+    outside the lock, so other previews are not held up by the download.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.PREVIEW_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def submit(self, file, kind, size, name):
+        target = preview_storage().path(name)
+        with self._lock:
+            future = self._pending.get(target)
+            if future is not None:
+                return future
+            future = self._pending[target] = Future()
+
+        def forget(future):
+            with self._lock:
+                self._pending.pop(target, None)
+
+        future.add_done_callback(forget)
+        storage = file.file.storage
+        encoding = file.blob.encoding if file.blob_id is not None else ''
+        copy = None
+        try:
+            if is_local_storage(storage):
+                source = storage.path(file.file.name)
+            else:
+                source, encoding = copy = _copy_source(file, kind, size, encoding)
+            with self._lock:
+                executor = self._get_executor()
+            rendering = executor.submit(render, source, encoding, kind, size, target)
+        except Exception as e:
+            if copy is not None:
+                os.remove(copy[0])
+            future.set_exception(e)
+            return future
+
+        def done(rendering):
+            if copy is not None:
+                os.remove(copy[0])
+            if rendering.cancelled():
+                future.cancel()
+            elif rendering.exception() is not None:
+                future.set_exception(rendering.exception())
+            else:
+                future.set_result(rendering.result())
+
+        rendering.add_done_callback(done)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+preview_generator = PreviewGenerator()
+atexit.register(preview_generator.shutdown)
+
+
+def get_preview(file, size):
+    """
+    Return the cached preview of ``file`` at ``size``, rendering it first
+    if needed. Returns None for files without previews and raises
+    PreviewPending when rendering takes longer than PREVIEW_TIMEOUT.
+    """
+    plan = _plan(file, size)
+    if plan is None:
+        return None
+    kind, size, name = plan
+    storage = preview_storage()
+    if not storage.exists(name):
+        try:
+            preview_generator.submit(file, kind, size, name).result(settings.PREVIEW_TIMEOUT)
+        except TimeoutError:
+            raise PreviewPending
+        except Exception:
+            logger.exception('Rendering preview %s failed', name)
+            return None
+    return PreviewFile(storage, name, CONTENT_TYPES[kind])
+
@@ -0,0 +1,77 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Blob, PendingDeletion
+
+try:
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    STORAGE_ERRORS = (OSError,)
+else:
+    # Object stores report failed deletions with their own exceptions.
+    STORAGE_ERRORS = (OSError, BotoCoreError, ClientError)
+
+
+def enqueue_deletions(paths, delay=0):
+    """
+    Queue stored files for deletion, not earlier than ``delay`` seconds from
+    now. Call it in the transaction that removes the rows referring to them,
+    so the queue entry is committed together with the rows being gone.
+    """
+    not_before = timezone.now() + timedelta(seconds=delay)
+    PendingDeletion.objects.bulk_create(
+        [PendingDeletion(path=path, next_attempt_at=not_before) for path in paths if path]
+    )
+
+
+def _still_referenced(paths):
+    # Blob file names start with their digest; content uploaded again
+    # after its blob was released may have re-adopted the queued file.
+    digests = [os.path.basename(path)[:64] for path in paths]
+    return set(
+        Blob.objects.filter(digest__in=digests, file__in=paths)
+        .values_list('file', flat=True)
+    )
+
+
+def reclaim(batch_size=None, max_attempts=None, now=None):
+    """
+    Delete one batch of queued files from storage. Failed deletions are
+    retried later with exponential backoff, up to ``max_attempts`` times.
+    Returns the number of entries processed and the number that failed.
+    """
+    batch_size = batch_size or settings.RECLAIM_BATCH_SIZE
+    max_attempts = max_attempts or settings.RECLAIM_MAX_ATTEMPTS
+    now = now or timezone.now()
+
+    batch = list(
+        PendingDeletion.objects.filter(
+            next_attempt_at__lte=now,
+            attempts__lt=max_attempts
+        ).order_by('next_attempt_at', 'id')[:batch_size]
+    )
+    referenced = _still_referenced([item.path for item in batch])
+
+    done, failed = [], 0
+    for item in batch:
+        if item.path not in referenced:
+            try:
+                default_storage.delete(item.path)
+            except STORAGE_ERRORS as e:
+                failed += 1
+                delay = settings.RECLAIM_RETRY_DELAY * 2 ** item.attempts
+                PendingDeletion.objects.filter(pk=item.pk).update(
+                    attempts=F('attempts') + 1,
+                    next_attempt_at=now + timedelta(seconds=delay),
+                    last_error=str(e)
+                )
+                continue
+        done.append(item.pk)
+
+    PendingDeletion.objects.filter(pk__in=done).delete()
+    return len(batch), failed
@@ -0,0 +1,92 @@
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .blobs import is_local_storage
+from .list_cache import invalidate_all
+from .models import Blob, File, sharded_path
+from .reclaim import enqueue_deletions
+
+
+def _target_name(old):
+    """
+    Return the path ``old`` should be stored at under the current layout.
+    Blobs live under ``blobs/``, other files under ``files/<author_pk>/``.
+    """
+    top, _, rest = old.partition('/')
+    if top == 'files':
+        author, _, _ = rest.partition('/')
+        directory = os.path.join('files', author)
+    else:
+        directory = top
+    return sharded_path(directory, os.path.basename(old))
+
+
+def _link(old, new):
+    """
+    Make the file ``old`` also available as ``new`` and return the name it
+    got. On local storage a file left at ``new`` by an interrupted run is
+    reused; other storages get a copy under an available name.
+    """
+    if not is_local_storage(default_storage):
+        with default_storage.open(old) as f:
+            return default_storage.save(new, f)
+    source = default_storage.path(old)
+    target = default_storage.path(new)
+    if os.path.exists(target):
+        if os.path.samefile(source, target):
+            return new
+        new = default_storage.get_available_name(new)
+        target = default_storage.path(new)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+    return new
+
+
+def _switch(model, pk, old, new, grace):
+    with transaction.atomic():
+        if model is Blob:
+            # Updating the blob row locks it, which orders this against
+            # uploads taking a reference and copying its path onto new files.
+            moved = Blob.objects.filter(pk=pk, file=old).update(file=new)
+            if moved:
+                File.objects.filter(blob_id=pk, file=old).update(file=new)
+        else:
+            moved = File.objects.filter(pk=pk, blob=None, file=old).update(file=new)
+        if moved:
+            enqueue_deletions([old], grace)
+            invalidate_all()
+        elif not model.objects.filter(file=new).exists():
+            # The row changed meanwhile; drop the copy unless it is in use.
+            enqueue_deletions([new], grace)
+    return bool(moved)
+
+
+def relayout(model, after=0, batch_size=500, grace=0):
+    """
+    Move one batch of stored files of ``model`` (Blob, or File rows without
+    a blob) with primary keys above ``after`` to their place in the current
+    layout. Each file is linked (or copied) to its new path first, then its
+    rows are switched over only if they still point to the old path, and
+    the old path is queued for reclamation after ``grace`` seconds so
+    requests that already loaded a row can still read it.
+
+    Returns the last primary key looked at, or None when there is nothing
+    left, and the number of files moved.
+    """
+    queryset = Blob.objects.all() if model is Blob else File.objects.filter(blob=None)
+    batch = list(
+        queryset.filter(pk__gt=after).order_by('pk').values_list('pk', 'file')[:batch_size]
+    )
+    moved = 0
+    for pk, old in batch:
+        new = _target_name(old)
+        if new == old or not default_storage.exists(old):
+            continue
+        moved += _switch(model, pk, old, _link(old, new), grace)
+    return (batch[-1][0] if batch else None), moved
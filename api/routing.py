@@ -0,0 +1,83 @@
+"""
+Primary/replica database routing.
+
+Reads go to one of DATABASE_REPLICAS only while a safe (GET, HEAD,
+OPTIONS) request is served, outside transactions; unsafe requests,
+background jobs and management commands read and write the primary. A user
+whose unsafe request succeeded is pinned to the primary for
+DATABASE_PIN_SECONDS, so they read their own writes despite replication
+lag.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_use_replicas = ContextVar('use_replicas', default=False)
+
+
+def _cache():
+    return caches[settings.DATABASE_PIN_CACHE_ALIAS]
+
+
+def _pin_key(user_id):
+    return f'api.routing.pin:{user_id}'
+
+
+def pin(user_id):
+    _cache().set(_pin_key(user_id), True, settings.DATABASE_PIN_SECONDS)
+
+
+def follow_user(user_id):
+    """
+    Read the rest of the current request from the primary if ``user_id``
+    wrote recently. Called once the request is authenticated.
+    """
+    if _use_replicas.get() and _cache().get(_pin_key(user_id)):
+        _use_replicas.set(False)
+
+
+def reading_replicas():
+    return _use_replicas.get()
+
+
+def use_replicas(enabled):
+    _use_replicas.set(enabled and bool(settings.DATABASE_REPLICAS))
+
+
+class PrimaryReplicaRouter:
+    # Credentials are read from the primary, so new tokens work right after
+    # login; authentication is cached, so this adds little load.
+    primary_models = {'authtoken.token', settings.AUTH_USER_MODEL.lower()}
+
+    def db_for_read(self, model, **hints):
+        if (_use_replicas.get() and model._meta.label_lower not in self.primary_models and
+                not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+
+class DatabaseRoutingMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        use_replicas(request.method in SAFE_METHODS)
+
+    def process_response(self, request, response):
+        use_replicas(False)
+        # DRF sets the user it authenticated on the Django request.
+        user = getattr(request, 'user', None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400 and
+                user is not None and user.is_authenticated):
+            pin(user.pk)
+        return response
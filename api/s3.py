@@ -0,0 +1,216 @@
+"""
+Storage backend for S3-compatible object stores (AWS S3, MinIO, ...).
+
+boto3 is only needed when the backend is used. Uploads go through boto3's
+managed transfers, which switch to parallel multipart uploads for large
+files; reads stream the object body and reopen it with a ``Range`` request
+on seek, so serving a range does not download the whole object.
+"""
+import io
+import posixpath
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+class S3File(File):
+    """
+    Read-only file over an object. Sequential reads share one streamed
+    response; seeking drops it and the next read starts a ranged GET.
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self._position = 0
+        self._body = None
+        self._size = None
+        self._closed = False
+        super().__init__(None, name)
+        self.mode = 'rb'
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._storage.size(self.name)
+        return self._size
+
+    def read(self, size=-1):
+        if self._body is None:
+            kwargs = {}
+            if self._position:
+                kwargs['Range'] = f'bytes={self._position}-'
+            self._body = self._storage._get_object(self.name, **kwargs)['Body']
+        data = self._body.read(None if size is None or size < 0 else size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self._position:
+            self._close_body()
+            self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def chunks(self, chunk_size=None):
+        self.seek(0)
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        for chunk in iter(lambda: self.read(chunk_size), b''):
+            yield chunk
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        self._close_body()
+        self._closed = True
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.DEFAULT_CHUNK_SIZE), b'')
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Keys are the storage names, under ``S3_STORAGE['PREFIX']`` if set.
+    ``path()`` is not supported, so callers needing a local file fall back
+    to ``open()`` / ``save()``.
+    """
+    # url() returns presigned links clients can be redirected to.
+    presigned_urls = True
+
+    def __init__(self, **options):
+        if boto3 is None:
+            raise ImproperlyConfigured('S3Storage requires the boto3 package.')
+        self.options = {**settings.S3_STORAGE, **options}
+        if not self.options.get('BUCKET'):
+            raise ImproperlyConfigured('S3_STORAGE has no BUCKET.')
+        self.bucket = self.options['BUCKET']
+        self.prefix = self.options.get('PREFIX', '').strip('/')
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = boto3.session.Session().client(
+                's3',
+                endpoint_url=self.options.get('ENDPOINT_URL') or None,
+                region_name=self.options.get('REGION') or None,
+                aws_access_key_id=self.options.get('ACCESS_KEY_ID') or None,
+                aws_secret_access_key=self.options.get('SECRET_ACCESS_KEY') or None,
+            )
+        return self._client
+
+    @property
+    def transfer_config(self):
+        return TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.S3_MAX_CONCURRENCY,
+        )
+
+    def _key(self, name):
+        name = name.replace('\\', '/')
+        return posixpath.join(self.prefix, name) if self.prefix else name
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def _get_object(self, name, **kwargs):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(name), **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('S3Storage only opens files for reading.')
+        return S3File(self, name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        self.client.upload_fileobj(
+            content, self.bucket, self._key(name), Config=self.transfer_config
+        )
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip('/')
+        prefix = prefix + '/' if prefix else ''
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for item in page.get('CommonPrefixes', ()):
+                directories.append(posixpath.basename(item['Prefix'].rstrip('/')))
+            for item in page.get('Contents', ()):
+                files.append(posixpath.basename(item['Key']))
+        return directories, files
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self._head(name)['LastModified']
+
+    def url(self, name, expires=None, disposition=None, content_type=None,
+            content_encoding=None):
+        """
+        Presigned GET URL, valid for ``expires`` seconds. The response
+        headers S3 sends can be overridden with the remaining arguments.
+        """
+        params = {'Bucket': self.bucket, 'Key': self._key(name)}
+        if disposition:
+            params['ResponseContentDisposition'] = disposition
+        if content_type:
+            params['ResponseContentType'] = content_type
+        if content_encoding:
+            params['ResponseContentEncoding'] = content_encoding
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params=params,
+            ExpiresIn=int(expires or settings.FILE_REDIRECT_EXPIRES)
+        )
@@ -0,0 +1,159 @@
+"""
+Search over file names, extensions and owners.
+
+The index lives outside the ORM in ``api_filesearch``: an FTS5 table keyed
+by file id on SQLite and a table with a trigram index on PostgreSQL. It is
+updated in the transaction changing the files, and queries only select ids
+from it, so visibility and ordering come from the usual File queryset.
+Other backends fall back to unindexed ``icontains`` lookups.
+"""
+import os
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+User = get_user_model()
+
+TABLE = 'api_filesearch'
+BATCH_SIZE = 500
+
+KEY_COLUMNS = {'sqlite': 'rowid', 'postgresql': 'file_id'}
+
+
+def file_extension(name):
+    return os.path.splitext(name or '')[1][1:].lower()
+
+
+def is_indexed():
+    return connection.vendor in KEY_COLUMNS
+
+
+def _rows(files):
+    owners = dict(
+        User.objects.filter(pk__in={file.author_id for file in files})
+        .values_list('pk', 'username')
+    )
+    return [
+        (file.pk, file.name, file_extension(file.name or file.token), owners.get(file.author_id, ''))
+        for file in files
+    ]
+
+
+def unindex_files(ids):
+    if not is_indexed():
+        return
+    key = KEY_COLUMNS[connection.vendor]
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'DELETE FROM {TABLE} WHERE {key} IN ({", ".join(["%s"] * len(batch))})',
+                batch
+            )
+
+
+def index_files(files):
+    """
+    Add ``files`` to the index or refresh their entries.
+    """
+    if not files or not is_indexed():
+        return
+    rows = _rows(files)
+    unindex_files([row[0] for row in rows])
+    key = KEY_COLUMNS[connection.vendor]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {TABLE} ({key}, name, extension, owner) VALUES (%s, %s, %s, %s)',
+            rows
+        )
+
+
+def rename_owner(user_id, username):
+    """
+    Update the owner of every file of ``user_id`` whose entry has another
+    username.
+    """
+    if not is_indexed():
+        return
+    key = KEY_COLUMNS[connection.vendor]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {TABLE} SET owner = %s WHERE {key} IN '
+            f'(SELECT id FROM api_file WHERE author_id = %s) AND owner <> %s',
+            [username, user_id, username]
+        )
+
+
+def rebuild_index():
+    """
+    Drop every entry and index all files again. Returns the number of
+    indexed files.
+    """
+    from .models import File
+
+    if not is_indexed():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    count = 0
+    files = File.objects.only('id', 'name', 'token', 'author_id').order_by('id')
+    last = 0
+    while True:
+        batch = list(files.filter(id__gt=last)[:BATCH_SIZE])
+        if not batch:
+            return count
+        index_files(batch)
+        count += len(batch)
+        last = batch[-1].pk
+
+
+def terms(query):
+    return [term for term in re.split(r'\s+', query.strip().lower()) if term]
+
+
+def _fts_query(words, extension):
+    # Every word has to start a token of some column; quoting keeps FTS5
+    # syntax in user input literal.
+    parts = ['"{}"*'.format(word.replace('"', '""')) for word in words]
+    if extension:
+        parts.append('extension : "{}"'.format(extension.replace('"', '""')))
+    return ' AND '.join(parts)
+
+
+def _like(word):
+    return '%{}%'.format(word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+def search_filter(query='', extension=''):
+    """
+    Q object selecting files whose name, extension or owner match every
+    word of ``query``, and whose extension is ``extension`` if given.
+    """
+    words = terms(query)
+    extension = extension.lower().lstrip('.')
+    if not words and not extension:
+        return Q(pk__in=[])
+    if connection.vendor == 'sqlite':
+        return Q(id__in=RawSQL(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s',
+            [_fts_query(words, extension)]
+        ))
+    if connection.vendor == 'postgresql':
+        conditions = ["lower(name || ' ' || owner) LIKE %s"] * len(words)
+        params = [_like(word) for word in words]
+        if extension:
+            conditions.append('extension = %s')
+            params.append(extension)
+        return Q(id__in=RawSQL(
+            f'SELECT file_id FROM {TABLE} WHERE {" AND ".join(conditions)}', params
+        ))
+    condition = Q()
+    for word in words:
+        condition &= Q(name__icontains=word) | Q(author__username__icontains=word)
+    if extension:
+        condition &= Q(name__iendswith=f'.{extension}')
+    return condition
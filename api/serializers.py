@@ -1,9 +1,20 @@
 import os
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri, iri_to_uri
+from rest_framework import ISO_8601
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from django.core.validators import MaxLengthValidator
 
-from .models import File
+from .blobs import discard_unsaved_blob, store_blob
+from .bulk import bulk_upload
+from .models import File, UploadSession, guess_content_type, make_token
+from .pipeline import start_processing
+from .uploads import open_session, received_chunks
+from .usage import charge, check_quota
 from .validators import unique_username_validator, unique_email_validator
 
 User = get_user_model()
@@ -15,6 +26,108 @@ class FileListSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class FileListValues:
+    """
+    Builds the FileListSerializer representation of files from ``values()``
+    rows, skipping model instances, FieldFile objects and per-field
+    serializer calls. Only file URLs and datetimes need converting; every
+    other column is already in its final form.
+    """
+
+    def __init__(self, context=None):
+        request = (context or {}).get('request')
+        self.names, self.keys, self.converters = [], [], []
+        for name, field in FileListSerializer(context=context).fields.items():
+            model_field = File._meta.get_field(field.source)
+            self.names.append(name)
+            self.keys.append(model_field.attname)
+            if isinstance(model_field, models.FileField):
+                self.converters.append((name, self._url_converter(model_field.storage, request)))
+            elif isinstance(model_field, models.DateTimeField):
+                self.converters.append((name, self._datetime_converter(field)))
+        self.pairs = list(zip(self.names, self.keys))
+
+    @staticmethod
+    def _url_converter(storage, request):
+        base_url = getattr(storage, 'base_url', None) or ''
+        # __class__ sees through the lazy default_storage wrapper.
+        if (getattr(storage.__class__, 'url', None) is FileSystemStorage.url and
+                base_url.startswith('/') and base_url.endswith('/') and
+                not base_url.startswith('//')):
+            # What storage.url and request.build_absolute_uri return for
+            # site-relative media URLs, without a urljoin per row.
+            prefix = iri_to_uri(base_url)
+            if request is not None:
+                prefix = request.build_absolute_uri('/')[:-1] + prefix
+
+            def convert(name):
+                path = filepath_to_uri(name).lstrip('/')
+                if path.startswith('.') or '/.' in path:
+                    return slow(name)
+                return prefix + path
+        else:
+            convert = None
+
+        def slow(name):
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert or slow
+
+    @staticmethod
+    def _datetime_converter(field):
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if not settings.USE_TZ or output_format is None or output_format.lower() != ISO_8601:
+            return field.to_representation
+        # Resolved once instead of per value, as DateTimeField does.
+        tz = getattr(field, 'timezone', None) or field.default_timezone()
+
+        def convert(value):
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+
+    def represent(self, rows):
+        pairs, converters = self.pairs, self.converters
+        result = []
+        for row in rows:
+            item = {name: row[key] for name, key in pairs}
+            for name, convert in converters:
+                value = item[name]
+                # FileField renders empty names as null, like None.
+                item[name] = convert(value) if value else None
+            result.append(item)
+        return result
+
+
+class FileTrendingSerializer(FileListSerializer):
+    downloads = serializers.IntegerField(read_only=True)
+
+
+class FileSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(required=False, default='', max_length=200)
+    extension = serializers.CharField(required=False, default='', max_length=20)
+
+    def validate(self, attrs):
+        if not attrs['q'].strip() and not attrs['extension'].strip():
+            raise serializers.ValidationError('Pass q, extension or both.')
+        return attrs
+
+
+class FileTrendingQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, default=7)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_days(self, value):
+        if value > settings.TRENDING_MAX_DAYS:
+            raise serializers.ValidationError(
+                f'Ensure this value is at most {settings.TRENDING_MAX_DAYS}.'
+            )
+        return value
+
+    def validate_limit(self, value):
+        return min(value, settings.TRENDING_LIMIT)
+
+
 class FileCreateSerializer(serializers.ModelSerializer):
     access = serializers.CharField(
         required=False
@@ -33,11 +146,110 @@ class FileCreateSerializer(serializers.ModelSerializer):
             **kwargs
         )
 
+    def create(self, validated_data):
+        content = validated_data.pop('file')
+        author = validated_data['author']
+        check_quota(author.pk, content.size)
+        blob = None
+        try:
+            with transaction.atomic():
+                # Charged before storing, so an upload over the quota
+                # writes nothing.
+                charge(author.pk, content.size)
+                blob = store_blob(content)
+                instance = File.objects.create(
+                    blob=blob,
+                    file=blob.file.name,
+                    token=make_token(content.name),
+                    name=content.name[:255],
+                    size=content.size,
+                    content_type=guess_content_type(content.name, content.content_type),
+                    **validated_data
+                )
+                start_processing([instance])
+        except Exception:
+            if blob is not None:
+                discard_unsaved_blob(blob)
+            raise
+        return instance
+
     class Meta:
         model = File
         fields = ('id', 'access', 'file')
 
 
+class FileBulkCreateSerializer(serializers.Serializer):
+    access = serializers.CharField(
+        required=False,
+        default='only_author'
+    )
+    files = serializers.ListField(
+        child=serializers.FileField(
+            max_length=1000,
+            allow_empty_file=False
+        ),
+        allow_empty=False
+    )
+
+    def validate_files(self, value):
+        if len(value) > settings.BULK_UPLOAD_MAX_FILES:
+            raise serializers.ValidationError(
+                f'Ensure at most {settings.BULK_UPLOAD_MAX_FILES} files are uploaded at once.'
+            )
+        return value
+
+    def create(self, validated_data):
+        return bulk_upload(
+            self.context.get(
+                'request'
+            ).user,
+            validated_data['files'],
+            validated_data['access']
+        )
+
+
+class FileBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=100000
+    )
+
+
+class FileArchiveSerializer(serializers.Serializer):
+    ids = serializers.CharField()
+    compression = serializers.ChoiceField(
+        choices=('store', 'deflate'),
+        default='store'
+    )
+
+    def validate_ids(self, value):
+        try:
+            ids = [int(i) for i in value.split(',') if i.strip()]
+        except ValueError:
+            raise serializers.ValidationError(
+                'Ensure ids is a comma separated list of integers.'
+            )
+        if not ids:
+            raise serializers.ValidationError('This field may not be blank.')
+        if len(ids) > settings.ARCHIVE_MAX_FILES:
+            raise serializers.ValidationError(
+                f'Ensure at most {settings.ARCHIVE_MAX_FILES} files are requested.'
+            )
+        return list(dict.fromkeys(ids))
+
+
+class FileLinkSerializer(serializers.Serializer):
+    expires_in = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_expires_in(self, value):
+        if value > settings.SIGNED_LINKS['MAX_TTL']:
+            raise serializers.ValidationError(
+                f"Ensure this value is at most {settings.SIGNED_LINKS['MAX_TTL']}."
+            )
+        return value
+
+
 class FileUpdateSerializer(serializers.ModelSerializer):
     access = serializers.CharField(
         required=True
@@ -48,6 +260,52 @@ class FileUpdateSerializer(serializers.ModelSerializer):
         fields = ('access', 'id')
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    access = serializers.CharField(
+        required=False
+    )
+    chunk_size = serializers.IntegerField(
+        required=False,
+        min_value=1
+    )
+    received_chunks = serializers.SerializerMethodField()
+
+    def get_received_chunks(self, obj):
+        return received_chunks(obj)
+
+    def validate_size(self, value):
+        if value > settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure size is at most {settings.UPLOAD_MAX_SIZE}.'
+            )
+        check_quota(self.context['request'].user.pk, value)
+        return value
+
+    def validate_chunk_size(self, value):
+        if value > settings.UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure chunk_size is at most {settings.UPLOAD_MAX_CHUNK_SIZE}.'
+            )
+        return value
+
+    def create(self, validated_data):
+        return open_session(
+            author=self.context.get(
+                'request'
+            ).user,
+            **validated_data
+        )
+
+    class Meta:
+        model = UploadSession
+        fields = (
+            'id', 'filename', 'size', 'access',
+            'chunk_size', 'chunk_count', 'received_chunks',
+            'expires_at'
+        )
+        read_only_fields = ('id', 'expires_at')
+
+
 class UserCreateSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(
         required=True,
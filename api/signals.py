@@ -0,0 +1,59 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .access import PUBLIC
+from .authentication import token_cache
+from .bulk import delete_files
+from .list_cache import invalidate
+from .models import File
+from .search import index_files, rename_owner
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_inactive_user_tokens(sender, instance, **kwargs):
+    if not instance.is_active:
+        token_cache.invalidate_user(
+            instance.pk,
+            Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+        )
+
+
+@receiver(post_save, sender=User)
+def rename_indexed_owner(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'username' in update_fields):
+        rename_owner(instance.pk, instance.username)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_files(sender, instance, **kwargs):
+    # The cascade would drop the rows without releasing their blobs, usage
+    # and search entries. Runs in the transaction deleting the user.
+    delete_files(File.objects.filter(author_id=instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_user_lists(sender, instance, **kwargs):
+    invalidate([instance.pk])
+
+
+@receiver(post_save, sender=File)
+def invalidate_saved_file(sender, instance, created, **kwargs):
+    # A changed file may have been public before the change.
+    invalidate([instance.author_id], public=not created or instance.access == PUBLIC)
+
+
+@receiver(post_save, sender=File)
+def index_saved_file(sender, instance, update_fields=None, **kwargs):
+    # Files created in bulk and deleted through delete_files are indexed
+    # there, without signals.
+    if update_fields is None or {'name', 'token', 'author'} & set(update_fields):
+        index_files([instance])
@@ -0,0 +1,115 @@
+"""
+Stateless signed links to files.
+
+A link carries everything needed to serve the file: its id, name, the
+disposition, an expiry and, with SIGNED_LINKS['INCLUDE_PATH'], the storage
+path and blob details. It is signed with an HMAC keyed by SECRET_KEY, the
+file id and the file's ``link_version``; bumping the version revokes every
+link of the file. Versions are read through the cache, so checking a link
+touches neither auth tables nor, usually, the File table.
+"""
+import base64
+import binascii
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signing import BadSignature, SignatureExpired
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .access import PUBLIC
+from .list_cache import invalidate
+from .models import File
+
+DISPOSITIONS = {'inline': 'i', 'attachment': 'a'}
+
+
+def _cache():
+    return caches[settings.SIGNED_LINKS['CACHE_ALIAS']]
+
+
+def _version_key(file_id):
+    return f'api.signing.link_version:{file_id}'
+
+
+def link_version(file_id):
+    """
+    Current link key version of a file, or None if it does not exist.
+    """
+    version = _cache().get(_version_key(file_id))
+    if version is None:
+        version = File.objects.filter(pk=file_id).values_list('link_version', flat=True).first()
+        if version is not None:
+            _cache().set(_version_key(file_id), version, settings.SIGNED_LINKS['VERSION_TTL'])
+    return version
+
+
+def revoke_links(file):
+    """
+    Invalidate every signed link of ``file`` issued so far.
+    """
+    File.objects.filter(pk=file.pk).update(link_version=F('link_version') + 1)
+    file.refresh_from_db(fields=['link_version'])
+    invalidate([file.author_id], public=file.access == PUBLIC)
+    _cache().set(_version_key(file.pk), file.link_version, settings.SIGNED_LINKS['VERSION_TTL'])
+    return file.link_version
+
+
+def forget_versions(file_ids):
+    _cache().delete_many([_version_key(file_id) for file_id in file_ids])
+
+
+def _signature(file_id, version, data):
+    return salted_hmac(
+        f'api.signing.link:{file_id}:{version}', data, algorithm='sha256'
+    ).hexdigest()
+
+
+def sign_link(file, disposition='inline', expires_in=None):
+    """
+    Return the signed value of a link to ``file`` and its expiry timestamp.
+    """
+    expires_in = min(
+        expires_in or settings.SIGNED_LINKS['TTL'], settings.SIGNED_LINKS['MAX_TTL']
+    )
+    expires = int(time.time() + expires_in)
+    payload = {
+        'f': file.pk,
+        'v': file.link_version,
+        'e': expires,
+        'd': DISPOSITIONS[disposition],
+        't': file.token,
+    }
+    if settings.SIGNED_LINKS['INCLUDE_PATH']:
+        payload['p'] = file.file.name
+        if file.blob_id is not None:
+            blob = file.blob
+            payload.update(b=blob.pk, h=blob.digest, n=blob.encoding, z=blob.size)
+    data = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(',', ':')).encode()
+    ).rstrip(b'=').decode()
+    return f'{data}.{_signature(file.pk, file.link_version, data)}', expires
+
+
+def unsign_link(value):
+    """
+    Check a signed link value and return its payload with the disposition
+    spelled out. Raises BadSignature for forged or revoked links and
+    SignatureExpired for expired ones.
+    """
+    data, _, signature = value.rpartition('.')
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+        file_id, version = payload['f'], payload['v']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise BadSignature('Malformed link.')
+    if not constant_time_compare(signature, _signature(file_id, version, data)):
+        raise BadSignature('Signature does not match.')
+    if payload['e'] < time.time():
+        raise SignatureExpired('Link expired.')
+    if link_version(file_id) != version:
+        raise BadSignature('Link was revoked.')
+    payload['d'] = next(name for name, code in DISPOSITIONS.items() if code == payload['d'])
+    return payload
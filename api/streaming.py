@@ -0,0 +1,191 @@
+import asyncio
+import mimetypes
+import re
+from functools import partial
+from urllib.parse import quote
+
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date, parse_http_date_safe
+
+from .compression import accepts_encoding, open_decoded
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.I)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``Range: bytes=...`` header into an inclusive
+    ``(start, end)`` pair. Returns None when the header should be ignored
+    (absent, malformed or multi-range) and raises RangeNotSatisfiable when
+    the range lies outside of the file.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or (last and end < start):
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+def content_disposition(disposition, filename):
+    try:
+        filename.encode('ascii')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=utf-8''{quote(filename)}"
+
+
+class RangedFileResponse(StreamingHttpResponse):
+    """
+    Streams ``length`` bytes of an open file starting at ``offset`` in
+    fixed-size blocks, so memory use does not depend on the file size.
+    """
+    block_size = CHUNK_SIZE
+
+    def __init__(self, filelike, offset=0, length=None, *args, **kwargs):
+        self.file_to_stream = filelike
+        self.offset = offset
+        self.length = length
+        super().__init__(self.iter_blocks(), *args, **kwargs)
+        self._resource_closers.append(filelike.close)
+
+    def iter_blocks(self):
+        filelike = self.file_to_stream
+        if self.offset:
+            filelike.seek(self.offset)
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            size = self.block_size if remaining is None else min(self.block_size, remaining)
+            chunk = filelike.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    async def aiter_blocks(self):
+        """
+        Same as iter_blocks, but every read runs in the default executor so
+        a slow client never blocks the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        filelike = self.file_to_stream
+        if self.offset:
+            await loop.run_in_executor(None, filelike.seek, self.offset)
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            size = self.block_size if remaining is None else min(self.block_size, remaining)
+            chunk = await loop.run_in_executor(None, filelike.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def file_etag(size, modified):
+    return f'"{size:x}-{int(modified * 1000000):x}"'
+
+
+def serve_file(request, field_file, content_type=None, disposition='inline',
+               filename=None, etag=None, cache_control=None, encoding='',
+               size=None):
+    """
+    Build a streaming response for ``field_file``, or any object with the
+    ``storage`` and ``name`` of a stored file. Conditional requests are
+    answered with 304 / 412 and ``Range`` / ``If-Range`` headers with 206.
+    Without an explicit ``etag`` one is derived from the file size and
+    modification time.
+
+    Files stored with a content ``encoding`` are sent as stored to clients
+    accepting it and decoded on the fly for the others; ``size`` is then the
+    decoded size.
+    """
+    storage = field_file.storage
+    try:
+        stored_size = storage.size(field_file.name)
+        modified = storage.get_modified_time(field_file.name).timestamp()
+    except FileNotFoundError:
+        raise Http404('File does not exist.')
+
+    vary = bool(encoding)
+    if encoding and accepts_encoding(request, encoding):
+        size = stored_size
+        open_file = partial(storage.open, field_file.name, 'rb')
+        if etag:
+            etag = f'{etag[:-1]}-{encoding}"'
+    else:
+        size = stored_size if size is None else size
+        open_file = partial(open_decoded, storage, field_file.name, encoding)
+        encoding = ''
+
+    etag = etag or file_etag(size, modified)
+    last_modified = http_date(modified)
+    response = get_conditional_response(request, etag=etag, last_modified=int(modified))
+    if response is not None:
+        return _set_validators(response, etag, last_modified, cache_control, vary)
+
+    filename = filename or field_file.name.split('/')[-1]
+    if content_type is None:
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag or (
+            parse_http_date_safe(if_range) == int(modified)
+    ):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        start, end = 0, size - 1
+        response = RangedFileResponse(open_file(), 0, size, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = RangedFileResponse(
+            open_file(), start, end - start + 1,
+            content_type=content_type, status=206
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition(disposition, filename)
+    return _set_validators(response, etag, last_modified, cache_control, vary)
+
+
+def _set_validators(response, etag, last_modified, cache_control, vary=False):
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    if vary:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
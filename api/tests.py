@@ -1,18 +1,81 @@
+import gzip
+import hashlib
+import io
+import zipfile
 import tempfile
 import os
 import shutil
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
 from django.urls import reverse
-from django.test import Client
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, CoreAPIClient
 
 from bebranie.settings import MEDIA_ROOT
-from .models import File
+from .access import (
+    ACCESS_LEVELS, BY_LINK, LINK, ONLY_AUTHOR, PUBLIC, READ, WRITE,
+    allowed_ids, filter_allowed
+)
+from .analytics import compact, record, roll_up
+from .asgi import FileStreamingASGIHandler
+from .authentication import CachedTokenAuthentication, token_cache
+from .counters import download_counter
+from .bulk import delete_files
+from .jobs import claim, prune_finished, run, work
+from .models import (
+    Blob, DownloadEvent, DownloadRollup, File, Job, PendingDeletion, StorageUsage,
+    UploadChunk, UploadSession
+)
+from .pipeline import start_processing
+from .previews import preview_generator
+from .reclaim import reclaim
+from .renderers import FastJSONRenderer
+from .serializers import FileListSerializer
+from .uploads import expire_sessions, open_session
+from .usage import QuotaExceeded, charge, check_quota, reconcile_usage
+from .views import download_file_async, file_redirect, file_response, view_file_async
 
 User = get_user_model()
 
 
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SignedInTestCase(APITestCase):
+    """
+    Signed in as sarah.connor, storing files in a temporary MEDIA_ROOT
+    that is removed after each test.
+    """
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+
 class FileTests(APITestCase):
     def setUp(self) -> None:
         self.client = Client()
@@ -191,9 +254,1268 @@ class FileTests(APITestCase):
             text = f.read()
             self.assertEqual(text, 'Inside test file1!')
 
+        self.assertEqual(File.objects.filter(id=self.file1.id).first().download_count, 10)
+        download_counter.flush()
         self.assertEqual(File.objects.filter(id=self.file1.id).first().download_count, 11)
 
         view_link = _response['view_link']
         response = self.client_auth.get(view_link)
         self.assertEqual(response, 'Inside test file1!')
 
+    def test_download_range(self):
+        name = self.file1.file.name.split('/')[-1]
+        self.assertEqual(self.file1.token, name)
+        url = reverse('download_file', args={name})
+
+        response = self.client.get(url, HTTP_RANGE='bytes=7-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 7-10/18')
+        self.assertEqual(b''.join(response.streaming_content), b'test')
+        self.assertEqual(File.objects.get(id=self.file1.id).download_count, 10)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), b'ile1!')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */18')
+
+        response = self.client.get(
+            url, HTTP_RANGE='bytes=7-10',
+            HTTP_IF_RANGE='Wed, 21 Oct 2015 07:28:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'Inside test file1!')
+        download_counter.flush()
+        self.assertEqual(File.objects.get(id=self.file1.id).download_count, 11)
+
+    @override_settings(DOWNLOAD_COUNTER_MAX_PENDING=3)
+    def test_download_counter_batches(self):
+        download_counter.incr(self.file.id)
+        download_counter.incr_many({self.file.id: 1, self.file1.id: 1})
+        self.assertEqual(download_counter.pending, 0)
+        self.assertEqual(File.objects.get(id=self.file.id).download_count, 2)
+        self.assertEqual(File.objects.get(id=self.file1.id).download_count, 11)
+
+        download_counter.incr(self.file.id)
+        self.assertEqual(download_counter.pending, 1)
+        self.assertEqual(File.objects.get(id=self.file.id).download_count, 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(download_counter.flush(), 1)
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(File.objects.get(id=self.file.id).download_count, 3)
+
+        # Failed flushes on the download path are logged and retried later.
+        with mock.patch.object(File.objects, 'filter', side_effect=DatabaseError), \
+                self.assertLogs('api.counters', 'ERROR'):
+            download_counter.incr_many({self.file.id: 3})
+        self.assertEqual(download_counter.pending, 3)
+        download_counter.flush()
+        self.assertEqual(File.objects.get(id=self.file.id).download_count, 6)
+
+
+class UploadSessionTests(SignedInTestCase):
+    def test_chunked_upload(self):
+        content = b'0123456789abcdefghij!'
+        response = self.client.post(reverse('uploads-list'), data={
+            'filename': 'notes.txt',
+            'size': len(content),
+            'chunk_size': 8,
+            'access': 'public'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['chunk_count'], 3)
+        session_id = response.data['id']
+
+        for index in (2, 0):
+            response = self.client.put(
+                reverse('uploads-chunk', args=(session_id, index)),
+                data=content[index * 8:(index + 1) * 8],
+                content_type='application/octet-stream'
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received_chunks'], [0, 2])
+
+        for index in (1, 0):
+            response = self.client.put(
+                reverse('uploads-chunk', args=(session_id, index)),
+                data=b'xx',
+                content_type='application/octet-stream'
+            )
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('uploads-finalize', args=(session_id,)))
+        self.assertEqual(response.status_code, 400)
+
+        self.client.put(
+            reverse('uploads-chunk', args=(session_id, 1)),
+            data=content[8:16],
+            content_type='application/octet-stream'
+        )
+        response = self.client.post(reverse('uploads-finalize', args=(session_id,)))
+        self.assertEqual(response.status_code, 201)
+
+        file = File.objects.get(id=response.data['id'])
+        self.assertEqual(file.access, 'public')
+        with file.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_session_size_is_bounded(self):
+        response = self.client.post(reverse('uploads-list'), data={
+            'filename': 'huge.bin', 'size': 10 ** 18
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('size', response.data)
+        self.assertFalse(UploadSession.objects.exists())
+
+        with mock.patch('builtins.open', side_effect=OSError('disk full')), \
+                self.assertRaises(OSError):
+            open_session(self.user, 'notes.txt', 10)
+        self.assertFalse(UploadSession.objects.exists())
+
+    @override_settings(USER_STORAGE_QUOTA=30)
+    def test_finalize_over_quota_can_be_retried(self):
+        content = b'x' * 20
+        session = open_session(self.user, 'notes.txt', len(content))
+        with open(session.part_path, 'wb') as f:
+            f.write(content)
+        UploadChunk.objects.create(session=session, index=0, size=len(content))
+        with transaction.atomic():
+            charge(self.user.pk, 20)
+
+        url = reverse('uploads-finalize', args=(session.pk,))
+        self.assertEqual(self.client.post(url).status_code, 413)
+        self.assertTrue(os.path.exists(session.part_path))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'blobs')))
+
+        with override_settings(USER_STORAGE_QUOTA=40):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        with File.objects.get(id=response.data['id']).file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_expire_sessions(self):
+        session = open_session(self.user, 'notes.txt', 10)
+        UploadSession.objects.filter(pk=session.pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        response = self.client.get(reverse('uploads-detail', args=(session.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(expire_sessions(), 1)
+        self.assertFalse(os.path.exists(session.part_path))
+
+
+class BlobStorageTests(SignedInTestCase):
+    def upload(self, name, content):
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile(name, content),
+            'access': 'public'
+        })
+        self.assertEqual(response.status_code, 201)
+        return File.objects.get(id=response.data['id'])
+
+    def test_same_content_is_stored_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.upload('setup.exe', b'installer')
+            second = self.upload('setup-copy.exe', b'installer')
+            other = self.upload('readme.txt', b'readme')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.token, second.token)
+        self.assertEqual(first.blob.digest, hashlib.sha256(b'installer').hexdigest())
+        self.assertEqual(Blob.objects.get(id=first.blob_id).ref_count, 2)
+        path = first.blob.file.path
+        self.assertEqual(len(os.listdir(os.path.dirname(path))), 1)
+
+        response = self.client.get(reverse('view_file', args={second.token}))
+        self.assertEqual(b''.join(response.streaming_content), b'installer')
+
+        self.client.delete(reverse('files-detail', args={first.id}))
+        self.assertEqual(Blob.objects.get(id=first.blob_id).ref_count, 1)
+        self.assertEqual(reclaim(), (0, 0))
+        self.assertTrue(os.path.exists(path))
+
+        self.client.delete(reverse('files-detail', args={second.id}))
+        self.assertFalse(Blob.objects.filter(id=first.blob_id).exists())
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(reclaim(), (1, 0))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(other.blob.file.path))
+
+    def test_deleting_user_releases_files(self):
+        file = self.upload('a.txt', b'content')
+        path = file.blob.file.path
+        self.user.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(reclaim(), (1, 0))
+        self.assertFalse(os.path.exists(path))
+
+    def test_admin_deletes_release_files(self):
+        first = self.upload('a.txt', b'first')
+        second = self.upload('b.txt', b'second')
+        file_admin = admin.site._registry[File]
+        file_admin.delete_model(None, first)
+        file_admin.delete_queryset(None, File.objects.filter(pk=second.pk))
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(StorageUsage.objects.get(user=self.user).files, 0)
+        self.assertEqual(PendingDeletion.objects.count(), 2)
+
+    def test_repeated_delete_releases_once(self):
+        first = self.upload('a.txt', b'shared')
+        second = self.upload('b.txt', b'shared')
+        for _ in range(2):
+            with transaction.atomic():
+                delete_files(File.objects.filter(pk=first.pk))
+        self.assertEqual(Blob.objects.get(id=second.blob_id).ref_count, 1)
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.bytes, usage.files), (len(b'shared'), 1))
+
+        response = self.client.post(
+            reverse('files-bulk-delete'), data={'ids': [first.id, second.id]}, format='json'
+        )
+        self.assertEqual(response.data['deleted'], [second.id])
+        self.assertFalse(Blob.objects.exists())
+
+    def test_bulk_delete(self):
+        files = [self.upload(f'{n}.txt', f'content {n % 2}'.encode()) for n in range(4)]
+        foreign = File.objects.create(
+            author=User.objects.create(username='other', email='other@skynet.com'),
+            file=SimpleUploadedFile('foreign.txt', b'foreign')
+        )
+        path = foreign.file.path
+
+        response = self.client.post(
+            reverse('files-bulk-delete'),
+            data={'ids': [f.id for f in files[:3]] + [foreign.id]},
+            format='json'
+        )
+        self.assertEqual(sorted(response.data['deleted']), [f.id for f in files[:3]])
+        self.assertEqual(list(File.objects.values_list('id', flat=True).order_by('id')),
+                         [files[3].id, foreign.id])
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(PendingDeletion.objects.count(), 1)
+
+        with transaction.atomic():
+            self.assertEqual(delete_files(File.objects.filter(pk=foreign.pk)), [foreign.id])
+        with mock.patch.object(FileSystemStorage, 'delete', side_effect=PermissionError('busy')):
+            self.assertEqual(reclaim(), (2, 2))
+        self.assertEqual(reclaim(), (0, 0))
+        retry = timezone.now() + timedelta(seconds=settings.RECLAIM_RETRY_DELAY + 1)
+        self.assertEqual(reclaim(now=retry), (2, 0))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    def test_bulk_upload_does_not_readopt_queued_file(self):
+        first = self.upload('a.txt', b'content')
+        path = first.blob.file.path
+        self.client.delete(reverse('files-detail', args={first.id}))
+        response = self.client.post(reverse('files-bulk'), data={
+            'files': [SimpleUploadedFile('b.txt', b'content')]
+        })
+        second = File.objects.get(id=response.data[0]['id'])
+        self.assertNotEqual(second.blob.file.path, path)
+
+        self.assertEqual(reclaim(), (1, 0))
+        self.assertFalse(os.path.exists(path))
+        with second.file.open('rb') as f:
+            self.assertEqual(f.read(), b'content')
+
+        response = self.client.post(reverse('files-bulk'), data={
+            'files': [SimpleUploadedFile('c.txt', b'content')]
+        })
+        third = File.objects.get(id=response.data[0]['id'])
+        self.assertEqual(third.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.get(id=second.blob_id).ref_count, 2)
+        self.assertEqual(reclaim(), (0, 0))
+
+    def test_conditional_get(self):
+        file = self.upload('photo.jpg', b'not really a photo')
+        url = reverse('view_file', args={file.token})
+
+        response = self.client.get(url)
+        self.assertEqual(response['ETag'], f'"{file.blob.digest}"')
+        self.assertIn('public', response['Cache-Control'])
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"{file.blob.digest}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{file.blob.digest}"')
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(
+            url, HTTP_RANGE='bytes=0-2', HTTP_IF_RANGE=f'"{file.blob.digest}"'
+        )
+        self.assertEqual(response.status_code, 206)
+
+        File.objects.filter(id=file.id).update(access='only_author')
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_bulk_upload(self):
+        response = self.client.post(reverse('files-bulk'), data={
+            'files': [
+                SimpleUploadedFile('a.txt', b'same'),
+                SimpleUploadedFile('b.txt', b'same'),
+                SimpleUploadedFile('c.txt', b'other'),
+            ],
+            'access': 'public'
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([r['name'] for r in response.data], ['a.txt', 'b.txt', 'c.txt'])
+
+        files = File.objects.filter(id__in=[r['id'] for r in response.data])
+        self.assertEqual({f.access for f in files}, {'public'})
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(
+            Blob.objects.get(digest=hashlib.sha256(b'same').hexdigest()).ref_count, 2
+        )
+
+        response = self.client.post(reverse('files-bulk'), data={
+            'files': [SimpleUploadedFile('empty.txt', b'')]
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_bulk_upload_removes_written_blobs(self):
+        with mock.patch.object(File.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('files-bulk'), data={
+                    'files': [SimpleUploadedFile('a.txt', b'new content')]
+                })
+        self.assertFalse(Blob.objects.exists())
+        blobs = os.path.join(settings.MEDIA_ROOT, 'blobs')
+        self.assertEqual([files for _, _, files in os.walk(blobs) if files], [])
+
+    def test_archive_download(self):
+        first = self.upload('a.txt', b'first file ' * 1000)
+        second = self.upload('b.txt', b'second file')
+        other = User.objects.create(username='other', email='other@skynet.com')
+        private = File.objects.create(
+            author=other,
+            file='files/0/private.txt',
+            token='private.txt'
+        )
+        by_link = File.objects.create(
+            author=other,
+            access=BY_LINK,
+            file='files/0/by_link.txt',
+            token='by_link.txt'
+        )
+        url = reverse('files-archive')
+
+        for compression in ('store', 'deflate'):
+            response = self.client.get(url, {
+                'ids': f'{second.id},{first.id}', 'compression': compression
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/zip')
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(archive.namelist(), [second.token, first.token])
+            self.assertEqual(archive.read(first.token), b'first file ' * 1000)
+            self.assertIsNone(archive.testzip())
+
+        download_counter.flush()
+        self.assertEqual(File.objects.get(id=first.id).download_count, 2)
+
+        response = self.client.get(url, {'ids': f'{first.id},{private.id}'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url, {'ids': str(by_link.id)})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url, {'ids': f'{first.id},0'})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(COMPRESS_AT_REST=True)
+    def test_compressed_storage(self):
+        text = b'timestamp,level,message\n' + b'2021-07-01,INFO,started\n' * 500
+        file = self.upload('log.csv', text)
+        photo = self.upload('photo.png', b'\x89PNG' + os.urandom(2000))
+        self.assertEqual(file.blob.encoding, 'gzip')
+        self.assertTrue(file.blob.file.name.endswith('.gz'))
+        self.assertEqual(file.blob.size, len(text))
+        self.assertLess(os.path.getsize(file.blob.file.path), len(text) // 5)
+        self.assertEqual(photo.blob.encoding, '')
+
+        url = reverse('download_file', args={file.token})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], f'"{file.blob.digest}-gzip"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), text)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(int(response['Content-Length']), len(text))
+        self.assertEqual(b''.join(response.streaming_content), text)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(text)}')
+        self.assertEqual(b''.join(response.streaming_content), text[100:200])
+
+        response = self.client.post(reverse('files-bulk'), data={
+            'files': [SimpleUploadedFile('copy.csv', text)]
+        })
+        self.assertEqual(File.objects.get(id=response.data[0]['id']).blob_id, file.blob_id)
+        response = self.client.get(reverse('files-archive'), {'ids': str(file.id)})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.read(file.token), text)
+        download_counter.flush()
+
+    def test_relayout_files(self):
+        with override_settings(FILE_STORAGE_FANOUT=()):
+            file = self.upload('a.txt', b'blob content')
+            legacy = File.objects.create(
+                author=self.user, file=SimpleUploadedFile('b.txt', b'legacy content')
+            )
+        old = [file.blob.file.name, legacy.file.name]
+        self.assertEqual(old[1], f'files/{self.user.pk}/{legacy.token}')
+
+        call_command('relayout_files', '--batch-size=1', '--grace=0', stdout=io.StringIO())
+        file.refresh_from_db()
+        legacy.refresh_from_db()
+        digest = file.blob.digest
+        self.assertEqual(file.blob.file.name, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}')
+        self.assertEqual(file.file.name, file.blob.file.name)
+        token = legacy.token
+        self.assertEqual(legacy.file.name, f'files/{self.user.pk}/{token[:2]}/{token[2:4]}/{token}')
+        response = self.client.get(reverse('view_file', args={legacy.token}))
+        self.assertEqual(b''.join(response.streaming_content), b'legacy content')
+
+        self.assertEqual(sorted(PendingDeletion.objects.values_list('path', flat=True)), old)
+        self.assertEqual(reclaim(), (2, 0))
+        self.assertFalse(any(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)) for name in old))
+        call_command('relayout_files', stdout=io.StringIO())
+        self.assertFalse(PendingDeletion.objects.exists())
+
+    @override_settings(FILE_REDIRECTS=True)
+    def test_presigned_redirects(self):
+        file = self.upload('report.pdf', b'report')
+        presign = mock.patch.object(
+            FileSystemStorage, 'url', create=True,
+            side_effect=lambda name, **params: f'https://bucket.example/{name}?signed'
+        )
+        with mock.patch.object(FileSystemStorage, 'presigned_urls', True, create=True), \
+                presign as url:
+            response = self.client.get(reverse('download_file', args={file.token}))
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response['Location'], f'https://bucket.example/{file.file.name}?signed')
+            self.assertIn('no-store', response['Cache-Control'])
+            self.assertEqual(
+                url.call_args[1]['disposition'], f'attachment; filename="{file.token}"'
+            )
+            response = self.client.get(reverse('files-link', args={file.id}))
+            self.assertTrue(response.data['direct_link'].startswith('https://bucket.example/'))
+        download_counter.flush()
+        self.assertEqual(File.objects.get(id=file.id).download_count, 1)
+
+        response = self.client.get(reverse('download_file', args={file.token}))
+        self.assertEqual(response.status_code, 200)
+        download_counter.flush()
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.files = [
+            File.objects.create(
+                author=self.user,
+                access='public',
+                file=f'files/{self.user.pk}/{n}.txt',
+                token=f'{n}.txt',
+                download_count=count
+            )
+            for n, count in enumerate([5, 3, 3, 3, 0])
+        ]
+
+    def test_pages_follow_download_count_then_id(self):
+        expected = [self.files[i].id for i in (0, 3, 2, 1, 4)]
+
+        response = self.client.get(reverse('files-list'), {'limit': 2, 'count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+        self.assertIsNone(response.data['previous'])
+        ids = [item['id'] for item in response.data['results']]
+
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+            self.assertNotIn('count', pages[-1])
+            ids += [item['id'] for item in pages[-1]['results']]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+
+        response = self.client.get(pages[-1]['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], expected[2:4])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], expected[:2])
+        self.assertIsNone(response.data['previous'])
+
+    @override_settings(FILE_LIST_MAX_PAGE_SIZE=3, FILE_LIST_PAGE_SIZE=2)
+    def test_page_size_is_bounded(self):
+        response = self.client.get(reverse('files-list'), {'limit': 1000})
+        self.assertEqual(len(response.data['results']), 3)
+
+        response = self.client.get(reverse('files-list'))
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.files[0].id, self.files[3].id]
+        )
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [self.files[2].id, self.files[1].id]
+        )
+        caches[settings.FILE_LIST_CACHE['CACHE_ALIAS']].clear()
+        with override_settings(FILE_LIST_PAGE_SIZE=5):
+            response = self.client.get(reverse('files-list'))
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response.data[0]['id'], self.files[0].id)
+
+        response = self.client.get(reverse('files-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsyncFileServingTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.file = File.objects.create(
+            author=self.user,
+            file=SimpleUploadedFile('notes.txt', b'0123456789' * 10000)
+        )
+        self.factory = RequestFactory()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_async_views_check_access(self):
+        request = self.factory.get('/')
+        response = async_to_sync(view_file_async)(request, self.file.token)
+        self.assertEqual(response.status_code, 403)
+
+        request = self.factory.get(
+            '/', HTTP_AUTHORIZATION=f'Token {self.token.key}', HTTP_RANGE='bytes=5-9'
+        )
+        response = async_to_sync(download_file_async)(request, self.file.token)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'56789')
+
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Token invalid')
+        response = async_to_sync(view_file_async)(request, self.file.token)
+        self.assertEqual(response.status_code, 401)
+
+    def test_async_download_counts_in_database_thread(self):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        threads = []
+
+        def incr(file_id):
+            threads.append(threading.current_thread())
+
+        with mock.patch.object(download_counter, 'incr', side_effect=incr):
+            response = async_to_sync(download_file_async)(request, self.file.token)
+        response.close()
+        self.assertEqual(threads, [threading.main_thread()])
+
+    def test_asgi_handler_streams_file_blocks(self):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        request.user = self.user
+        response = file_response(request, self.file)
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(FileStreamingASGIHandler().send_response)(response, send)
+        self.assertEqual(messages[0]['status'], 200)
+        body = [m['body'] for m in messages[1:-1]]
+        self.assertEqual(len(body), 2)
+        self.assertEqual(b''.join(body), b'0123456789' * 10000)
+        self.assertFalse(messages[-1].get('more_body', False))
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        token_cache.clear()
+
+    def test_token_lookup_is_cached(self):
+        url = reverse('files-list')
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(first.captured_queries) - len(second.captured_queries), 1)
+        self.assertFalse(any('authtoken_token' in q['sql'] for q in second.captured_queries))
+
+    def test_token_deletion_invalidates_cache(self):
+        url = reverse('files-list')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(reverse('logout')).status_code, 204)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_deactivation_invalidates_cache(self):
+        url = reverse('files-list')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_cache_holds_no_user_instances(self):
+        self.user.set_password('judgment-day')
+        self.user.save()
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.token.key)
+        second, token = auth.authenticate_credentials(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual((second.pk, second.username), (self.user.pk, 'sarah.connor'))
+        self.assertEqual(token.user_id, self.user.pk)
+        entry = token_cache._get(self.token.key)
+        self.assertNotIn(self.user.password, entry.user)
+        self.assertIn('password', second.get_deferred_fields())
+
+
+class AccessPolicyTests(APITestCase):
+    def setUp(self) -> None:
+        self.author = User.objects.create(username='author', email='author@skynet.com')
+        self.other = User.objects.create(username='other', email='other@skynet.com')
+        self.files = {
+            level: File.objects.create(
+                author=self.author,
+                access=level,
+                file=f'files/{self.author.pk}/{level}.txt',
+                token=f'{level}.txt'
+            )
+            for level in ACCESS_LEVELS
+        }
+
+    def test_rules(self):
+        files = list(File.objects.all())
+        anonymous = AnonymousUser()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                {f.access for f in filter_allowed(LINK, anonymous, files)}, {PUBLIC}
+            )
+            self.assertEqual(
+                {f.access for f in filter_allowed(LINK, self.other, files)}, {PUBLIC, BY_LINK}
+            )
+            self.assertEqual(
+                {f.access for f in filter_allowed(READ, self.other, files)}, {PUBLIC}
+            )
+            self.assertEqual(filter_allowed(WRITE, self.other, files), [])
+            self.assertEqual(len(filter_allowed(WRITE, self.author, files)), 3)
+
+    def test_queryset_filters_match_object_checks(self):
+        ids = [f.id for f in self.files.values()]
+        for action in (READ, LINK, WRITE):
+            for user in (AnonymousUser(), self.other, self.author):
+                expected = {f.id for f in filter_allowed(action, user, self.files.values())}
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(allowed_ids(action, user, ids), expected)
+                self.assertLessEqual(len(queries.captured_queries), 1)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_link_check_does_not_load_author(self):
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, ignore_errors=True)
+        file = self.files[ONLY_AUTHOR]
+        default_storage.save(file.file.name, ContentFile(b'secret'))
+        self.client.force_authenticate(self.author)
+        url = reverse('view_file', args={file.token})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'secret')
+
+        self.client.force_authenticate(self.other)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+
+class SignedLinkTests(SignedInTestCase):
+    def setUp(self) -> None:
+        caches['default'].clear()
+        super().setUp()
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('plan.txt', b'judgment day'),
+            'access': 'only_author'
+        })
+        self.file = File.objects.get(id=response.data['id'])
+
+    def links(self, **params):
+        response = self.client.get(reverse('files-link', args={self.file.id}), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_signed_links_skip_auth_and_file_lookup(self):
+        links = self.links()
+        client = Client()
+        response = client.get(links['signed_download_link'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'judgment day')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertIn('public', response['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            response = client.get(links['signed_view_link'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('inline', response['Content-Disposition'])
+
+        signature = links['signed_view_link'].rstrip('/').split('/')[-2]
+        response = client.get(reverse('signed_file', args=(signature[:-1] + 'x', self.file.token)))
+        self.assertEqual(response.status_code, 403)
+        response = client.get(reverse('signed_file', args=(signature, 'other.txt')))
+        self.assertEqual(response.status_code, 404)
+        with mock.patch('api.signing.time.time', return_value=time.time() + 2 * 60 * 60):
+            response = client.get(links['signed_view_link'])
+        self.assertEqual(response.status_code, 403)
+        download_counter.flush()
+
+    def test_signed_link_follows_moved_file(self):
+        link = self.links()['signed_view_link']
+        old = self.file.file.path
+        name = os.path.join(os.path.dirname(self.file.file.name), 'moved')
+        os.replace(old, os.path.join(settings.MEDIA_ROOT, name))
+        Blob.objects.filter(pk=self.file.blob_id).update(file=name)
+        File.objects.filter(pk=self.file.pk).update(file=name)
+
+        response = Client().get(link)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'judgment day')
+
+    def test_revoke_links(self):
+        old = self.links()['signed_view_link']
+        response = self.client.post(reverse('files-revoke-links', args={self.file.id}))
+        self.assertEqual(response.data['link_version'], 1)
+        self.assertEqual(Client().get(old).status_code, 403)
+
+        with override_settings(SIGNED_LINKS={**settings.SIGNED_LINKS, 'INCLUDE_PATH': False}):
+            new = self.links(expires_in=60)['signed_view_link']
+            response = Client().get(new)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'judgment day')
+
+        self.client.force_authenticate(User.objects.create(username='other', email='o@skynet.com'))
+        response = self.client.post(reverse('files-revoke-links', args={self.file.id}))
+        self.assertEqual(response.status_code, 403)
+
+
+class StorageUsageTests(SignedInTestCase):
+    def usage(self):
+        return self.client.get(reverse('files-usage')).data
+
+    @override_settings(USER_STORAGE_QUOTA=100)
+    def test_usage_and_quota(self):
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('notes.txt', b'x' * 40)
+        })
+        file = File.objects.get(id=response.data['id'])
+        self.assertEqual((file.size, file.content_type), (40, 'text/plain'))
+        self.client.post(reverse('files-bulk'), data={
+            'files': [SimpleUploadedFile('a.json', b'y' * 20), SimpleUploadedFile('b.json', b'y' * 20)]
+        })
+        self.assertEqual(self.usage(), {'bytes': 80, 'files': 3, 'quota': 100})
+
+        with self.assertNumQueries(1):
+            check_quota(self.user.pk, 20)
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('big.bin', b'z' * 21)
+        })
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post(reverse('uploads-list'), data={'filename': 'big.bin', 'size': 21})
+        self.assertEqual(response.status_code, 413)
+        with mock.patch('api.serializers.check_quota'):
+            response = self.client.post(reverse('files-list'), data={
+                'file': SimpleUploadedFile('big.bin', b'z' * 21)
+            })
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(
+            os.path.join(settings.MEDIA_ROOT, 'blobs')
+        )), 2)
+        with self.assertRaises(QuotaExceeded), transaction.atomic():
+            charge(self.user.pk, 21)
+
+        self.client.delete(reverse('files-detail', args={file.id}))
+        self.assertEqual(self.usage()['bytes'], 40)
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('big.bin', b'z' * 21)
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.usage(), {'bytes': 61, 'files': 3, 'quota': 100})
+
+    def test_reconcile_usage(self):
+        for n in range(3):
+            self.client.post(reverse('files-list'), data={
+                'file': SimpleUploadedFile(f'{n}.txt', b'content')
+            })
+        StorageUsage.objects.filter(user=self.user).update(bytes=1, files=10)
+        out = io.StringIO()
+        call_command('reconcile_usage', '--dry-run', stdout=out)
+        self.assertIn('1 bytes in 10 file(s) recorded, 21 bytes in 3 file(s) stored', out.getvalue())
+        self.assertEqual(self.usage()['bytes'], 1)
+        call_command('reconcile_usage', stdout=io.StringIO())
+        self.assertEqual(self.usage(), {'bytes': 21, 'files': 3, 'quota': None})
+        self.assertEqual(reconcile_usage(), {})
+
+
+class PreviewTests(SignedInTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        preview_generator.shutdown()
+        super().tearDownClass()
+
+    def upload(self, name, content):
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile(name, content)
+        })
+        return File.objects.get(id=response.data['id'])
+
+    def test_text_preview_is_rendered_once(self):
+        text = b''.join(b'line %d of the log\n' % n for n in range(1000))
+        file = self.upload('log.txt', text)
+        url = reverse('view_file', args={file.token})
+
+        response = self.client.get(url, {'preview': 128})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        preview = b''.join(response.streaming_content)
+        self.assertTrue(text.startswith(preview))
+        self.assertTrue(preview.endswith(b'\n'))
+        self.assertLessEqual(len(preview), settings.PREVIEW_TEXT_BYTES)
+
+        with mock.patch.object(preview_generator, 'submit') as submit:
+            response = self.client.get(url, {'preview': 512})
+            self.assertEqual(b''.join(response.streaming_content), preview)
+        submit.assert_not_called()
+
+        self.assertEqual(self.client.get(url, {'preview': 100}).status_code, 400)
+        binary = self.upload('data.bin', b'\x00\x01')
+        response = self.client.get(reverse('view_file', args={binary.token}), {'preview': 128})
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(COMPRESS_AT_REST=True)
+    def test_text_preview_of_remote_file(self):
+        text = b''.join(b'line %d of the log\n' % n for n in range(1000))
+        file = self.upload('log.txt', text)
+        self.assertEqual(file.blob.encoding, 'gzip')
+        with mock.patch('api.previews.is_local_storage', return_value=False):
+            response = self.client.get(reverse('view_file', args={file.token}), {'preview': 128})
+        preview = b''.join(response.streaming_content)
+        self.assertTrue(text.startswith(preview))
+        self.assertGreater(len(preview), settings.PREVIEW_TEXT_BYTES // 2)
+
+    @override_settings(PREVIEW_EAGER_SIZES=(128,))
+    def test_eager_previews(self):
+        file = self.upload('notes.md', b'# Notes\n')
+        self.assertEqual(work(threading.Event(), burst=True), 1)
+        name = f'{file.blob.digest[:2]}/{file.blob.digest}-{settings.PREVIEW_TEXT_BYTES}.txt'
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'previews', name)))
+
+
+class JobQueueTests(SignedInTestCase):
+    def test_upload_pipeline(self):
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('picture.txt', b'%PDF-1.4 not really text'),
+            'access': 'public'
+        })
+        file_id = response.data['id']
+        response = self.client.get(reverse('files-list'))
+        self.assertEqual(response.data[0]['processing_status'], 'pending')
+        self.assertEqual(Job.objects.get().payload, {'file_id': file_id})
+
+        self.assertEqual(work(threading.Event(), burst=True), 1)
+        file = File.objects.get(id=file_id)
+        self.assertEqual(file.processing_status, 'ready')
+        self.assertEqual(file.content_type, 'application/pdf')
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_retries_then_failure(self):
+        file = File.objects.create(author=self.user, file='files/missing.txt', token='missing.txt')
+        start_processing([file])
+        job = claim('worker')
+        self.assertIsNone(claim('other'))
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(run(job), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('FileNotFoundError', job.last_error)
+        self.assertIsNone(claim('worker'))
+
+        later = timezone.now() + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** 10)
+        for attempt in range(2, job.max_attempts + 1):
+            job = claim('worker', now=later)
+            self.assertEqual(job.attempts, attempt)
+            with self.assertLogs('api.jobs', 'WARNING'):
+                status = run(job)
+        self.assertEqual(status, Job.FAILED)
+        self.assertEqual(File.objects.get(id=file.id).processing_status, 'failed')
+
+    def test_prune_finished(self):
+        now = timezone.now()
+        old = now - timedelta(seconds=settings.JOB_RETENTION + 1)
+        jobs = [
+            Job.objects.create(name='test', status=status, finished_at=finished_at)
+            for status, finished_at in [
+                (Job.DONE, old), (Job.FAILED, old), (Job.DONE, now), (Job.QUEUED, None)
+            ]
+        ]
+        self.assertEqual(prune_finished(now=now, batch_size=1), 2)
+        self.assertEqual(
+            sorted(Job.objects.values_list('id', flat=True)), [jobs[2].id, jobs[3].id]
+        )
+        with override_settings(JOB_RETENTION=None):
+            self.assertEqual(prune_finished(now=now + timedelta(days=365)), 0)
+
+
+class DownloadAnalyticsTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.other = User.objects.create(
+            email='j.connor@skynet.com',
+            username='john.connor'
+        )
+        self.public = File.objects.create(author=self.other, file='files/a.txt', access='public')
+        self.private = File.objects.create(author=self.other, file='files/b.txt')
+        self.own = File.objects.create(author=self.user, file='files/c.txt')
+        self.client.force_authenticate(self.user)
+
+    def test_flush_logs_events_and_schedules_roll_up(self):
+        download_counter.incr_many({self.public.id: 2, self.own.id: 1})
+        download_counter.flush()
+        download_counter.incr_many({self.public.id: 1})
+        download_counter.flush()
+        self.assertEqual(
+            sorted(DownloadEvent.objects.values_list('file_id', 'count')),
+            sorted([(self.public.id, 2), (self.own.id, 1), (self.public.id, 1)])
+        )
+        job = Job.objects.get(name='analytics.roll_up')
+        self.assertGreater(job.run_at, timezone.now())
+
+        # Too recent to roll up yet.
+        self.assertEqual(roll_up(), 0)
+        later = timezone.now() + timedelta(seconds=settings.DOWNLOAD_ROLLUP_DELAY)
+        self.assertEqual(roll_up(batch_size=2, now=later), 2)
+        self.assertEqual(roll_up(batch_size=2, now=later), 1)
+        self.assertEqual(roll_up(now=later), 0)
+        for period in (DownloadRollup.HOUR, DownloadRollup.DAY):
+            self.assertEqual(dict(
+                DownloadRollup.objects.filter(period=period).values_list('file_id', 'count')
+            ), {self.public.id: 3, self.own.id: 1})
+
+        much_later = later + timedelta(seconds=settings.DOWNLOAD_HOURLY_RETENTION + 3600)
+        self.assertEqual(compact(now=much_later), (3, 2))
+        self.assertEqual(DownloadRollup.objects.count(), 2)
+
+    def test_trending(self):
+        record({self.public.id: 5, self.private.id: 9, self.own.id: 2})
+        record({self.own.id: 4})
+        record({self.public.id: 100}, occurred_at=timezone.now() - timedelta(days=30))
+        roll_up(now=timezone.now() + timedelta(seconds=settings.DOWNLOAD_ROLLUP_DELAY))
+
+        response = self.client.get(reverse('files-trending'))
+        self.assertEqual(
+            [(f['id'], f['downloads']) for f in response.data],
+            [(self.own.id, 6), (self.public.id, 5)]
+        )
+        self.assertEqual(response.data[0]['file'], 'http://testserver/media/files/c.txt')
+        response = self.client.get(reverse('files-trending'), {'days': 31, 'limit': 1})
+        self.assertEqual(
+            [(f['id'], f['downloads']) for f in response.data], [(self.public.id, 105)]
+        )
+        response = self.client.get(reverse('files-trending'), {'days': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class FileListValuesTests(APITestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.client.force_authenticate(self.user)
+        for i, name in enumerate(['plain.txt', 'Отчёт\u2028.txt', '']):
+            File.objects.create(
+                author=self.user, file=f'files/1/{i} {name}', name=name, download_count=i
+            )
+
+    def test_matches_serializer_output(self):
+        for params in ({}, {'limit': 2}):
+            response = self.client.get(reverse('files-list'), params)
+            request = response.wsgi_request
+            files = File.objects.order_by('-download_count', '-id')
+            data = FileListSerializer(
+                files[:2] if params else files, many=True, context={'request': request}
+            ).data
+            if params:
+                data = {'next': response.data['next'], 'previous': None, 'results': data}
+            self.assertEqual(response.content, JSONRenderer().render(data))
+        self.assertIn(b'\\u2028', response.content)
+        data = {'at': timezone.now(), 'day': timezone.now().date(), 'name': 'Отчёт'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class ListCacheTests(APITestCase):
+    def setUp(self) -> None:
+        caches[settings.FILE_LIST_CACHE['CACHE_ALIAS']].clear()
+        self.user = User.objects.create(
+            email='s.connor@skynet.com',
+            username='sarah.connor'
+        )
+        self.other = User.objects.create(
+            email='j.connor@skynet.com',
+            username='john.connor'
+        )
+        self.public = File.objects.create(author=self.other, file='files/a.txt', access='public')
+
+    def ids(self, **params):
+        response = self.client.get(reverse('files-list'), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data['results'] if params else response.data
+        return [file['id'] for file in data]
+
+    def test_pages_are_cached_until_files_change(self):
+        self.assertEqual(self.ids(), [self.public.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ids(), [self.public.id])
+
+        # Private files of others leave anonymous pages alone.
+        private = File.objects.create(author=self.other, file='files/b.txt')
+        with self.assertNumQueries(0):
+            self.ids()
+        second = File.objects.create(author=self.other, file='files/c.txt', access='public')
+        self.assertEqual(self.ids(), [second.id, self.public.id])
+        self.assertEqual(self.ids(limit=1), [second.id])
+
+        download_counter.incr_many({self.public.id: 1})
+        download_counter.flush()
+        self.assertEqual(self.ids(), [self.public.id, second.id])
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.ids(), [self.public.id, second.id, private.id])
+        self.client.patch(
+            reverse('files-detail', args={second.id}), data={'access': 'only_author'}
+        )
+        self.client.delete(reverse('files-detail', args={private.id}))
+        self.assertEqual(self.ids(), [self.public.id, second.id])
+        self.client.force_authenticate(None)
+        self.assertEqual(self.ids(), [self.public.id])
+
+    def test_stats(self):
+        self.ids()
+        self.ids()
+        self.ids(limit=1)
+        response = self.client.get(reverse('files-cache-stats'))
+        self.assertIn(response.status_code, (401, 403))
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('files-cache-stats'))
+        self.assertEqual(
+            (response.data['hits'], response.data['misses']), (1, 2)
+        )
+        self.assertAlmostEqual(response.data['hit_ratio'], 1 / 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ReplicaRoutingTests(TransactionTestCase):
+    def setUp(self) -> None:
+        caches[settings.FILE_LIST_CACHE['CACHE_ALIAS']].clear()
+        caches[settings.DATABASE_PIN_CACHE_ALIAS].clear()
+        self.workdir = tempfile.mkdtemp()
+        connections.databases['replica'] = dict(
+            connections.databases['default'], NAME=os.path.join(self.workdir, 'replica.sqlite3')
+        )
+        self.user = User.objects.create(email='s.connor@skynet.com', username='sarah.connor')
+        self.token = Token.objects.create(user=self.user)
+        self.public = File.objects.create(author=self.user, file='files/a.txt', access='public')
+        self.replicate()
+
+    def tearDown(self) -> None:
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def replicate(self):
+        connections['replica'].close()
+        target = sqlite3.connect(connections.databases['replica']['NAME'])
+        connections['default'].ensure_connection()
+        connections['default'].connection.backup(target)
+        target.close()
+
+    def ids(self, **headers):
+        response = self.client.get(reverse('files-list'), **headers)
+        self.assertEqual(response.status_code, 200)
+        return [file['id'] for file in response.json()]
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_reads_go_to_replicas_until_the_user_writes(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        hidden = File.objects.create(author=self.user, file='files/b.txt', access='public')
+        # Not replicated yet, so nobody sees it.
+        self.assertEqual(self.ids(), [self.public.id])
+        self.assertEqual(self.ids(**auth), [self.public.id])
+
+        response = self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('new.txt', b'new'),
+            'access': 'public'
+        }, **auth)
+        self.assertEqual(response.status_code, 201)
+        new = response.json()['id']
+        # The uploader reads the primary, everybody else the lagging replica.
+        self.assertEqual(self.ids(**auth), [new, hidden.id, self.public.id])
+        self.assertEqual(self.ids(), [self.public.id])
+
+        self.replicate()
+        caches[settings.FILE_LIST_CACHE['CACHE_ALIAS']].clear()
+        self.assertEqual(self.ids(), [new, hidden.id, self.public.id])
+        with override_settings(DATABASE_PIN_SECONDS=0):
+            response = self.client.patch(
+                reverse('files-detail', args={new}), data={'access': 'only_author'},
+                content_type='application/json', **auth
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(File.objects.using('replica').get(id=new).access, 'public')
+        self.assertEqual(File.objects.get(id=new).access, 'only_author')
+
+
+class FileSearchTests(SignedInTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.other = User.objects.create(
+            email='m.dyson@cyberdyne.com',
+            username='miles.dyson'
+        )
+
+    def search(self, **params):
+        response = self.client.get(reverse('files-search'), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(file['name'] for file in response.data)
+
+    def test_search_names_extensions_and_owners(self):
+        self.client.post(reverse('files-list'), data={
+            'file': SimpleUploadedFile('Annual Report 2023.pdf', b'report'),
+            'access': 'only_author'
+        })
+        self.client.post(reverse('files-bulk'), data={
+            'files': [
+                SimpleUploadedFile('report_draft.txt', b'draft'),
+                SimpleUploadedFile('holiday.jpg', b'holiday')
+            ]
+        })
+        File.objects.create(
+            author=self.other, file='files/neural.pdf', name='Neural net.pdf', access='public'
+        )
+        File.objects.create(
+            author=self.other, file='files/secret.pdf', name='Skynet report.pdf'
+        )
+
+        self.assertEqual(self.search(q='repo'), ['Annual Report 2023.pdf', 'report_draft.txt'])
+        self.assertEqual(self.search(q='report 2023'), ['Annual Report 2023.pdf'])
+        self.assertEqual(
+            self.search(extension='pdf'), ['Annual Report 2023.pdf', 'Neural net.pdf']
+        )
+        self.assertEqual(self.search(q='dyson'), ['Neural net.pdf'])
+        self.assertEqual(self.search(q='"report'), ['Annual Report 2023.pdf', 'report_draft.txt'])
+        response = self.client.get(reverse('files-search'))
+        self.assertEqual(response.status_code, 400)
+
+        self.other.username = 'm.bennett'
+        self.other.save()
+        self.assertEqual(self.search(q='dyson'), [])
+        self.assertEqual(self.search(q='bennett'), ['Neural net.pdf'])
+
+        report = File.objects.get(name='report_draft.txt')
+        self.client.delete(reverse('files-detail', kwargs={'id': report.id}))
+        self.assertEqual(self.search(q='draft'), [])
+        report = File.objects.get(name='Annual Report 2023.pdf')
+        report.name = 'Quarterly.pdf'
+        report.save()
+        self.assertEqual(self.search(q='annual'), [])
+        self.assertEqual(self.search(q='quarter'), ['Quarterly.pdf'])
+
+
+try:
+    import boto3
+    import moto
+except ImportError:
+    boto3 = moto = None
+
+
+@skipUnless(moto, 'S3 tests need boto3 and moto')
+@override_settings(
+    S3_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+    S3_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024
+)
+class S3StorageTests(SimpleTestCase):
+    def setUp(self) -> None:
+        mock_aws = getattr(moto, 'mock_aws', None) or moto.mock_s3
+        self.mock = mock_aws()
+        self.mock.start()
+        self.addCleanup(self.mock.stop)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='files')
+
+        from .s3 import S3Storage
+        self.storage = S3Storage(BUCKET='files', PREFIX='media', REGION='us-east-1')
+
+    def test_multipart_upload_and_ranged_reads(self):
+        content = os.urandom(12 * 1024 * 1024)
+        name = self.storage.save('blobs/ab/cd/abcd', io.BytesIO(content))
+        self.assertEqual(name, 'blobs/ab/cd/abcd')
+        head = self.storage.client.head_object(Bucket='files', Key='media/blobs/ab/cd/abcd')
+        self.assertTrue(head['ETag'].endswith('-3"'))
+        self.assertEqual(self.storage.size(name), len(content))
+        self.assertEqual(self.storage.listdir('blobs/ab'), (['cd'], []))
+
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(10), content[:10])
+            f.seek(len(content) - 10)
+            self.assertEqual(f.read(), content[-10:])
+
+        url = self.storage.url(name, disposition='attachment; filename="a.bin"')
+        self.assertIn('Signature', url)
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    @override_settings(FILE_REDIRECTS=True)
+    def test_presigned_redirect(self):
+        import requests
+        self.storage.save('files/1/report.pdf', io.BytesIO(b'report'))
+        file = File(token='report.pdf', file='files/1/report.pdf')
+        file.file.storage = self.storage
+        response = file_redirect(RequestFactory().get('/'), file, 'attachment')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('no-store', response['Cache-Control'])
+        self.assertIn('response-content-disposition=attachment', response['Location'])
+        self.assertEqual(requests.get(response['Location']).content, b'report')
+
+    def test_relayout_copies_objects(self):
+        from .relayout import _link
+        self.storage.save('blobs/abcd', io.BytesIO(b'content'))
+        with mock.patch('api.relayout.default_storage', self.storage):
+            self.assertEqual(_link('blobs/abcd', 'blobs/ab/cd/abcd'), 'blobs/ab/cd/abcd')
+        with self.storage.open('blobs/ab/cd/abcd') as f:
+            self.assertEqual(f.read(), b'content')
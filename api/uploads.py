@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .blobs import adopt_blob_file, discard_unsaved_blob
+from .models import File, UploadChunk, UploadSession, guess_content_type, make_token
+from .pipeline import start_processing
+from .streaming import CHUNK_SIZE
+from .usage import charge
+
+
+class ChunkError(Exception):
+    pass
+
+
+def session_expiry():
+    return timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+
+
+def open_session(author, filename, size, access='only_author', chunk_size=None):
+    """
+    Start an upload session. The size is checked against UPLOAD_MAX_SIZE
+    and the quota by UploadSessionSerializer. The row is only saved once
+    its part file exists.
+    """
+    session = UploadSession(
+        author=author,
+        filename=filename,
+        size=size,
+        access=access,
+        chunk_size=chunk_size or settings.UPLOAD_CHUNK_SIZE,
+        expires_at=session_expiry()
+    )
+    os.makedirs(os.path.dirname(session.part_path), exist_ok=True)
+    # A sparse file of the final size lets chunks be written in place at
+    # their own offsets, in any order and from parallel requests.
+    try:
+        with open(session.part_path, 'wb') as f:
+            f.truncate(session.size)
+        session.save(force_insert=True)
+    except Exception:
+        _remove(session.part_path)
+        raise
+    return session
+
+
+def write_chunk(session, index, stream):
+    if not 0 <= index < session.chunk_count:
+        raise ChunkError(f'Chunk index must be between 0 and {session.chunk_count - 1}.')
+
+    expected = session.chunk_length(index)
+    # The chunk is received into a scratch file and only copied into the
+    # part file once its length checks out, so a rejected retry never
+    # overwrites a chunk that was already accepted.
+    written = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(session.part_path)) as scratch:
+        while written <= expected:
+            data = stream.read(min(CHUNK_SIZE, expected + 1 - written))
+            if not data:
+                break
+            scratch.write(data[:expected - written])
+            written += len(data)
+
+        if written != expected:
+            raise ChunkError(f'Chunk {index} must be exactly {expected} bytes long.')
+
+        scratch.seek(0)
+        with open(session.part_path, 'r+b') as f:
+            f.seek(index * session.chunk_size)
+            shutil.copyfileobj(scratch, f, CHUNK_SIZE)
+
+    UploadChunk.objects.update_or_create(
+        session=session,
+        index=index,
+        defaults={'size': written}
+    )
+    UploadSession.objects.filter(pk=session.pk).update(expires_at=session_expiry())
+
+
+def received_chunks(session):
+    return list(
+        session.chunks.order_by('index').values_list('index', flat=True)
+    )
+
+
+def finalize_session(session):
+    """
+    Turn a complete session into a File. The assembled part file is read
+    once to hash it and then linked into blob storage, never copied. The
+    quota is charged first; if saving fails anyway, the part file is kept
+    so finalizing can be retried.
+    """
+    blob = None
+    try:
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            received = session.chunks.count()
+            if received != session.chunk_count:
+                missing = session.chunk_count - received
+                raise ChunkError(f'{missing} of {session.chunk_count} chunks are missing.')
+
+            charge(session.author_id, session.size)
+            blob = adopt_blob_file(session.part_path)
+            instance = File.objects.create(
+                author=session.author,
+                access=session.access,
+                blob=blob,
+                file=blob.file.name,
+                token=make_token(session.filename),
+                name=session.filename[:255],
+                size=session.size,
+                content_type=guess_content_type(session.filename)
+            )
+            start_processing([instance])
+            session.delete()
+    except Exception:
+        if blob is not None:
+            discard_unsaved_blob(blob)
+        raise
+    return instance
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_session(session):
+    _remove(session.part_path)
+    session.delete()
+
+
+def expire_sessions(now=None):
+    expired = UploadSession.objects.filter(expires_at__lt=now or timezone.now())
+    count = 0
+    for session in expired.iterator():
+        discard_session(session)
+        count += 1
+    return count
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import UserViewSet, FileViewSet, download_file, view_file
+from .views import (
+    UserViewSet, FileViewSet, UploadSessionViewSet, download_file, view_file,
+    download_file_async, view_file_async, signed_file
+)
 
 router = DefaultRouter()
 router.register(
@@ -14,10 +18,19 @@ router.register(
     FileViewSet,
     basename='files'
 )
+router.register(
+    'uploads',
+    UploadSessionViewSet,
+    basename='uploads'
+)
+
+if settings.ASYNC_FILE_SERVING:
+    view_file, download_file = view_file_async, download_file_async
 
 urlpatterns = [
     path('files/view/<str:filename>/', view_file, name='view_file'),
     path('files/download/<str:filename>/', download_file, name='download_file'),
+    path('files/signed/<str:signature>/<str:filename>/', signed_file, name='signed_file'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken'))
 ]
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import File, StorageUsage
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Storage quota exceeded.'
+    default_code = 'quota_exceeded'
+
+
+def get_usage(user_id):
+    """
+    Return ``(bytes, files)`` stored by a user with one primary key lookup.
+    """
+    usage = StorageUsage.objects.filter(user_id=user_id).values_list('bytes', 'files').first()
+    return usage or (0, 0)
+
+
+def check_quota(user_id, size):
+    """
+    Raise QuotaExceeded if storing ``size`` more bytes would take the user
+    over USER_STORAGE_QUOTA. Meant to reject uploads before they are
+    written; charge enforces the quota again when they are saved.
+    """
+    quota = settings.USER_STORAGE_QUOTA
+    if quota is not None and get_usage(user_id)[0] + size > quota:
+        raise QuotaExceeded
+
+
+def charge(user_id, size, files=1):
+    """
+    Add stored files to a user's usage, failing with QuotaExceeded when they
+    do not fit in the quota. The check and the update are one conditional
+    UPDATE, so concurrent uploads cannot overshoot. Must be called inside
+    the transaction saving the files.
+    """
+    quota = settings.USER_STORAGE_QUOTA
+    usage = StorageUsage.objects.filter(user_id=user_id)
+    if quota is not None:
+        usage = usage.filter(bytes__lte=quota - size)
+    changes = {'bytes': F('bytes') + size, 'files': F('files') + files}
+    if usage.update(**changes):
+        return
+    if quota is not None and size > quota:
+        raise QuotaExceeded
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(user_id=user_id, bytes=size, files=files)
+    except IntegrityError:
+        # The row exists, so the update failed on the quota, unless another
+        # upload created it in the meantime.
+        if not usage.update(**changes):
+            raise QuotaExceeded
+
+
+def release(usage):
+    """
+    Subtract deleted files, given as ``{user_id: (bytes, files)}``.
+    """
+    for user_id, (size, files) in usage.items():
+        StorageUsage.objects.filter(user_id=user_id).update(
+            bytes=F('bytes') - size, files=F('files') - files
+        )
+
+
+def file_usage(queryset):
+    """
+    Sizes and counts of the files in ``queryset`` per author, as accepted
+    by release.
+    """
+    return {
+        row['author_id']: (row['bytes'] or 0, row['files'])
+        for row in queryset.values('author_id').annotate(
+            bytes=Sum('size'), files=Count('id')
+        ).order_by()
+    }
+
+
+def reconcile_usage(fix=True):
+    """
+    Recompute usage from the File table and return the users whose stored
+    totals drifted, as ``{user_id: (stored, actual)}``. With ``fix`` the
+    stored totals are corrected, each user under a lock on their usage row
+    so uploads and deletions running meanwhile are not lost.
+    """
+    actual = file_usage(File.objects.all())
+    stored = {
+        user_id: (size, files)
+        for user_id, size, files in StorageUsage.objects.values_list('user_id', 'bytes', 'files')
+    }
+    drift = {
+        user_id: (stored.get(user_id, (0, 0)), actual.get(user_id, (0, 0)))
+        for user_id in stored.keys() | actual.keys()
+        if stored.get(user_id, (0, 0)) != actual.get(user_id, (0, 0))
+    }
+    if fix:
+        for user_id in drift:
+            with transaction.atomic():
+                list(StorageUsage.objects.select_for_update().filter(user_id=user_id))
+                size, files = file_usage(
+                    File.objects.filter(author_id=user_id)
+                ).get(user_id, (0, 0))
+                StorageUsage.objects.update_or_create(
+                    user_id=user_id, defaults={'bytes': size, 'files': files}
+                )
+    return drift
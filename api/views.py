@@ -1,28 +1,60 @@
-import os
-from django.db.models import Q
-from django.http import FileResponse, HttpResponse
+import io
+import mimetypes
+import time
+from datetime import datetime
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import default_storage
+from django.core.signing import BadSignature
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_safe
 from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied
 from rest_framework.response import Response
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.settings import api_settings
 
-from bebranie.settings import MEDIA_ROOT
+from .access import LINK, PUBLIC, READ, access_filter, can, filter_allowed
+from .analytics import trending_files
+from .archives import COMPRESSION, iter_zip, unique_names
+from .compression import accepts_encoding, open_decoded
 from .permissions import RegistrationPermission, FilePermissions
-from .paginators import VariablePageSizePaginator
+from .paginators import KeysetPaginator
+from .streaming import content_disposition, serve_file
 from .serializers import (
     UserCreateSerializer, FileCreateSerializer, FileUpdateSerializer,
-    FileListSerializer
+    FileListSerializer, FileListValues, UploadSessionSerializer,
+    FileBulkCreateSerializer, FileBulkDeleteSerializer, FileArchiveSerializer,
+    FileLinkSerializer, FileTrendingSerializer, FileTrendingQuerySerializer,
+    FileSearchSerializer
 )
-from .models import File
+from . import list_cache
+from .bulk import bulk_delete, delete_files
+from .counters import download_counter
+from .models import Blob, File
+from .previews import PreviewPending, get_preview
+from .search import search_filter
+from .signing import revoke_links, sign_link, unsign_link
+from .uploads import ChunkError, discard_session, finalize_session, write_chunk
+from .usage import get_usage
 
 User = get_user_model()
 
+PERMISSION_DENIED = 'You do not have permission to perform this action.'
+
 
 class FileViewSet(viewsets.ModelViewSet):
     permission_classes = [FilePermissions]
-    pagination_class = VariablePageSizePaginator
+    pagination_class = KeysetPaginator
     queryset = File.objects.all()
     lookup_field = 'id'
     http_method_names = ['get', 'post', 'patch', 'delete']
@@ -36,29 +68,154 @@ class FileViewSet(viewsets.ModelViewSet):
             return FileListSerializer
 
     def perform_destroy(self, instance):
-        try:
-            os.remove(MEDIA_ROOT + '/' + str(instance.file))
-        except PermissionError:
-            pass
-        instance.delete()
+        with transaction.atomic():
+            delete_files(File.objects.filter(pk=instance.pk))
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-
-        if request.user.is_authenticated:
-            queryset = queryset.filter(
-                Q(access='public') | Q(author=request.user)
+        def build():
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                access_filter(READ, request.user)
             )
-        else:
-            queryset = queryset.filter(access='public')
+            return self.paginated_response(queryset).data
+        return Response(list_cache.get_or_build(request, build))
 
+    def paginated_response(self, queryset):
+        # Listings are read only, so they skip model instances and
+        # serializer fields and are built from values() rows.
+        values = FileListValues(self.get_serializer_context())
+        queryset = queryset.values(*values.keys)
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return self.get_paginated_response(values.represent(page))
+        return Response(values.represent(queryset))
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='bulk',
+        url_name='bulk'
+    )
+    def bulk_create(self, request):
+        serializer = FileBulkCreateSerializer(
+            data=request.data,
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        failed = any('error' in result for result in results)
+        return Response(
+            data=results,
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+        )
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='bulk-delete',
+        url_name='bulk-delete'
+    )
+    def bulk_destroy(self, request):
+        serializer = FileBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = bulk_delete(request.user, serializer.validated_data['ids'])
+        return Response(data={'deleted': deleted})
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='usage',
+        permission_classes=[IsAuthenticated],
+        url_name='usage'
+    )
+    def usage(self, request):
+        size, files = get_usage(request.user.pk)
+        return Response(data={
+            'bytes': size,
+            'files': files,
+            'quota': settings.USER_STORAGE_QUOTA
+        })
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='cache-stats',
+        permission_classes=[IsAdminUser],
+        url_name='cache-stats'
+    )
+    def cache_stats(self, request):
+        return Response(data=list_cache.stats())
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='search',
+        url_name='search'
+    )
+    def search(self, request):
+        serializer = FileSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.get_queryset().filter(
+            access_filter(READ, request.user),
+            search_filter(
+                serializer.validated_data['q'], serializer.validated_data['extension']
+            )
+        )
+        return self.paginated_response(queryset)
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='trending',
+        url_name='trending'
+    )
+    def trending(self, request):
+        serializer = FileTrendingQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        files = trending_files(
+            serializer.validated_data['days'],
+            File.objects.filter(access_filter(READ, request.user)),
+            serializer.validated_data.get('limit')
+        )
+        return Response(data=FileTrendingSerializer(
+            files, many=True, context=self.get_serializer_context()
+        ).data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='archive',
+        url_name='archive'
+    )
+    def archive(self, request):
+        serializer = FileArchiveSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        files = list(File.objects.select_related('blob').filter(id__in=ids))
+        if len(files) != len(ids):
+            raise NotFound
+        if len(filter_allowed(READ, request.user, files)) != len(files):
+            raise PermissionDenied
+        files.sort(key=lambda file: ids.index(file.id))
+
+        entries = [
+            (
+                name,
+                file.blob.size if file.blob_id is not None else file.file.size,
+                partial(
+                    open_decoded, file.file.storage, file.file.name,
+                    file.blob.encoding if file.blob_id is not None else ''
+                )
+            )
+            for name, file in zip(unique_names(f.token for f in files), files)
+        ]
+        response = StreamingHttpResponse(
+            iter_zip(entries, COMPRESSION[serializer.validated_data['compression']]),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = content_disposition('attachment', 'files.zip')
+        download_counter.incr_many({file.id: 1 for file in files})
+        return response
 
     @action(
         methods=['GET'],
@@ -68,63 +225,319 @@ class FileViewSet(viewsets.ModelViewSet):
         url_name='link'
     )
     def file_link(self, request, id):
+        serializer = FileLinkSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        expires_in = serializer.validated_data.get('expires_in')
+
         file = self.get_object()
-        name = file.file.name.split('/')[-1]
+        name = file.token
         view_link = request.build_absolute_uri(reverse('view_file', args={name}))
         download_link = request.build_absolute_uri(reverse('download_file', args={name}))
+        data = {
+            'id': file.id,
+            'view_link': view_link,
+            'download_link': download_link
+        }
+        for disposition, key in (('inline', 'signed_view_link'), ('attachment', 'signed_download_link')):
+            signature, expires = sign_link(file, disposition, expires_in)
+            data[key] = request.build_absolute_uri(
+                reverse('signed_file', args=(signature, name))
+            )
+        data['expires_at'] = datetime.fromtimestamp(expires, timezone.utc)
+        if redirects_enabled(file):
+            data['direct_link'] = presigned_url(file, 'attachment')
+        return Response(data=data)
+
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path='revoke-links',
+        permission_classes=[FilePermissions],
+        url_name='revoke-links'
+    )
+    def revoke(self, request, id):
+        file = self.get_object()
+        return Response(data={'id': file.id, 'link_version': revoke_links(file)})
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadSessionSerializer
+    http_method_names = ['get', 'post', 'put', 'delete']
+
+    def get_queryset(self):
+        return self.request.user.upload_sessions.filter(
+            expires_at__gt=timezone.now()
+        )
+
+    def perform_destroy(self, instance):
+        discard_session(instance)
+
+    @action(
+        methods=['PUT'],
+        detail=True,
+        url_path=r'chunks/(?P<index>\d+)',
+        url_name='chunk'
+    )
+    def upload_chunk(self, request, pk, index):
+        session = self.get_object()
+        try:
+            write_chunk(session, int(index), request.stream or io.BytesIO())
+        except ChunkError as e:
+            return Response(
+                data={'detail': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(self.get_serializer(session).data)
+
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path='finalize',
+        url_name='finalize'
+    )
+    def finalize(self, request, pk):
+        session = self.get_object()
+        try:
+            file = finalize_session(session)
+        except ChunkError as e:
+            return Response(
+                data={'detail': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(
-            data={
-                'id': file.id,
-                'view_link': view_link,
-                'download_link': download_link
-            }
+            data=FileCreateSerializer(file, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+def file_etag(file):
+    if file.blob_id is not None:
+        return f'"{file.blob.digest}"'
+    return None
+
+
+def file_encoding(file):
+    if file.blob_id is not None:
+        return {'encoding': file.blob.encoding, 'size': file.blob.size}
+    return {}
+
+
+def file_cache_control(file):
+    if file.access == PUBLIC:
+        return {'public': True, 'max_age': settings.FILE_CACHE_MAX_AGE}
+    return {'private': True, 'no_cache': True}
+
+
+def get_linked_file(filename):
+    return get_object_or_404(File.objects.select_related('blob'), token=filename)
+
+
+def redirects_enabled(file):
+    return settings.FILE_REDIRECTS and getattr(file.file.storage, 'presigned_urls', False)
+
+
+def file_content_type(file, disposition):
+    if disposition == 'attachment':
+        return f"application/{file.token.split('.')[-1]}"
+    return mimetypes.guess_type(file.token)[0] or 'application/octet-stream'
+
+
+def presigned_url(file, disposition, encoding=''):
+    return file.file.storage.url(
+        file.file.name,
+        disposition=content_disposition(disposition, file.token),
+        content_type=file_content_type(file, disposition),
+        content_encoding=encoding or None
+    )
+
+
+def file_redirect(request, file, disposition):
+    """
+    Redirect to a short-lived presigned URL of the stored file, so its bytes
+    do not pass through the app. Returns None when the file has to be
+    served here: redirects are off, the storage cannot presign or the client
+    does not accept the encoding the file is stored in.
+    """
+    if not redirects_enabled(file):
+        return None
+    encoding = file.blob.encoding if file.blob_id is not None else ''
+    if encoding and not accepts_encoding(request, encoding):
+        return None
+    response = HttpResponseRedirect(presigned_url(file, disposition, encoding))
+    patch_cache_control(response, private=True, no_store=True)
+    if encoding:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    # Counted like served files: only requests starting at the beginning.
+    response.offset = None if request.headers.get('Range') else 0
+    return response
+
+
+def preview_response(request, file, cache_control=None):
+    try:
+        size = int(request.GET['preview'])
+    except ValueError:
+        size = None
+    if size not in settings.PREVIEW_SIZES:
+        sizes = ', '.join(str(size) for size in settings.PREVIEW_SIZES)
+        return JsonResponse(
+            {'detail': f'Preview size must be one of {sizes}.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        preview = get_preview(file, size)
+    except PreviewPending:
+        response = JsonResponse(
+            {'detail': 'Preview is being generated, try again shortly.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response['Retry-After'] = 1
+        return response
+    if preview is None:
+        return JsonResponse(
+            {'detail': 'No preview is available for this file.'},
+            status=status.HTTP_404_NOT_FOUND
         )
+    extension = preview.name.rsplit('.', 1)[-1]
+    return serve_file(
+        request, preview,
+        content_type=preview.content_type,
+        filename=f"{file.token.rsplit('.', 1)[0]}-preview.{extension}",
+        cache_control=cache_control or file_cache_control(file)
+    )
+
+
+def stored_file_response(request, file, disposition='inline', cache_control=None):
+    """
+    Response for ``file`` built from storage alone, without database
+    queries, so it may run in any thread.
+    """
+    if disposition == 'inline' and 'preview' in request.GET:
+        return preview_response(request, file, cache_control)
+    response = file_redirect(request, file, disposition)
+    if response is None:
+        response = serve_file(
+            request, file.file,
+            content_type=file_content_type(file, disposition),
+            disposition=disposition,
+            filename=file.token,
+            etag=file_etag(file),
+            cache_control=cache_control or file_cache_control(file),
+            **file_encoding(file)
+        )
+    return response
+
+
+def count_download(file, disposition, response):
+    # Resumed and seeking requests are not counted as new downloads.
+    if disposition == 'attachment' and getattr(response, 'offset', None) == 0:
+        download_counter.incr(file.id)
+
+
+def file_response(request, file, disposition='inline', cache_control=None):
+    response = stored_file_response(request, file, disposition, cache_control)
+    count_download(file, disposition, response)
+    return response
 
 
 @api_view(['GET'])
 def view_file(request, filename):
-    file = get_object_or_404(File, file__endswith=filename)
-    if file.access == 'public' or (
-            file.access == 'by_link' and
-            request.user and
-            request.user.is_authenticated
-    ) or (
-            request.user and
-            file.author == request.user
-    ):
-        return FileResponse(open(f'media/{file.file.name}', 'rb'))
+    file = get_linked_file(filename)
+    if can(LINK, request.user, file):
+        return file_response(request, file)
     return Response(
-        data={"detail": "You do not have permission to perform this action."},
+        data={"detail": PERMISSION_DENIED},
         status=status.HTTP_403_FORBIDDEN
     )
 
 
 @api_view(['GET'])
 def download_file(request, filename):
-    file = get_object_or_404(File, file__endswith=filename)
-    if file.access == 'public' or (
-            file.access == 'by_link' and
-            request.user and
-            request.user.is_authenticated
-    ) or (
-            request.user and
-            file.author == request.user
-    ):
-        with open(f'media/{file.file.name}', 'rb') as f:
-            data = f.read()
-        file.download_count += 1
-        file.save()
-        ext = file.file.name.split('.')[-1]
-        response = HttpResponse(data, content_type=f'application/{ext}')
-        response['Content-Disposition'] = f'attachment; filename="{file.file.name}"'
-        return response
-
+    file = get_linked_file(filename)
+    if can(LINK, request.user, file):
+        return file_response(request, file, disposition='attachment')
     return Response(
-        data={"detail": "You do not have permission to perform this action."},
+        data={"detail": PERMISSION_DENIED},
         status=status.HTTP_403_FORBIDDEN
     )
 
 
+@require_safe
+def signed_file(request, signature, filename):
+    """
+    Serve a file from a signed link. Links are checked without
+    authentication; those carrying the storage path are served from the
+    signed data alone, without loading the file, while that path exists.
+    """
+    try:
+        link = unsign_link(signature)
+    except BadSignature as e:
+        return JsonResponse({'detail': str(e)}, status=status.HTTP_403_FORBIDDEN)
+    if link['t'] != filename:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    # relayout_files may have moved the file since the link was signed.
+    if 'p' in link and default_storage.exists(link['p']):
+        file = File(pk=link['f'], token=link['t'], file=link['p'])
+        if 'b' in link:
+            file.blob = Blob(pk=link['b'], digest=link['h'], encoding=link['n'], size=link['z'])
+    else:
+        file = get_object_or_404(File.objects.select_related('blob'), pk=link['f'])
+    # Anyone holding the link may read the file until it expires, so shared
+    # caches may keep it as long.
+    max_age = min(link['e'] - int(time.time()), settings.FILE_CACHE_MAX_AGE)
+    return file_response(
+        request, file, link['d'],
+        cache_control={'public': True, 'max_age': max(max_age, 0)}
+    )
+
+
+async def authenticate_async(request):
+    """
+    Run the configured DRF authentication classes for a plain Django
+    request. Returns the user, AnonymousUser, or raises APIException.
+    """
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = await sync_to_async(authentication_class().authenticate)(request)
+        if result is not None:
+            return result[0]
+    return AnonymousUser()
+
+
+async def serve_file_async(request, filename, disposition):
+    try:
+        request.user = await authenticate_async(request)
+    except APIException as e:
+        return JsonResponse({'detail': e.detail}, status=e.status_code)
+
+    file = await sync_to_async(get_linked_file)(filename)
+    if not can(LINK, request.user, file):
+        return JsonResponse(
+            {'detail': PERMISSION_DENIED},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    # Only headers are prepared here. Under FileStreamingASGIHandler the
+    # body is then read in a thread pool block by block. Storage calls may
+    # block, so they run in any thread; counting the download may flush
+    # counters and stays in the thread owning the database connections.
+    response = await sync_to_async(stored_file_response, thread_sensitive=False)(
+        request, file, disposition
+    )
+    await sync_to_async(count_download)(file, disposition, response)
+    return response
+
+
+async def view_file_async(request, filename):
+    return await serve_file_async(request, filename, 'inline')
+
+
+async def download_file_async(request, filename):
+    return await serve_file_async(request, filename, 'attachment')
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [RegistrationPermission, ]
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.routing.DatabaseRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,26 +76,112 @@ CORS_URLS_REGEX = r'^/api/.*$'
 
 WSGI_APPLICATION = 'bebranie.wsgi.application'
 
+# Serve view and download links with async views. Only useful when running
+# under ASGI (bebranie.asgi), where file bodies are streamed without
+# holding a worker thread per client.
+ASYNC_FILE_SERVING = os.environ.get('ASYNC_FILE_SERVING', '') == '1'
+
 REST_FRAMEWORK = {
+    # orjson is used when installed, otherwise it behaves as JSONRenderer.
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'file_lists': {
+        'BACKEND': os.environ.get(
+            'FILE_LIST_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('FILE_LIST_CACHE_LOCATION', 'file-lists'),
+    },
+}
+
+# Pages of GET /api/files/ are cached for TTL seconds in CACHE_ALIAS and
+# invalidated by versioned keys when listed files change. With several
+# processes, point FILE_LIST_CACHE_BACKEND at a file-based or shared cache
+# (FILE_LIST_CACHE_LOCATION is then its directory or server address).
+FILE_LIST_CACHE = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'file_lists',
+    'TTL': 60,
+}
+
+# Authenticated tokens are kept in an in-process LRU for TTL seconds.
+# Set CACHE_ALIAS to one of CACHES to share them between processes.
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SEND_ACTIVATION_EMAIL': False,
 }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# The database comes from the environment: DATABASE_ENGINE=postgresql with
+# DATABASE_NAME, _USER, _PASSWORD, _HOST and _PORT, or SQLite in
+# DATABASE_NAME (db.sqlite3 by default). Connections are kept open for
+# DATABASE_CONN_MAX_AGE seconds instead of one per request; put pgbouncer
+# in front of PostgreSQL to pool them across processes.
+#
+# DATABASE_REPLICAS is a comma separated list of read replicas of the same
+# database: host[:port] entries for PostgreSQL, file names for SQLite. They
+# become the replica_<n> aliases, read by safe requests (see api.routing).
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite3')
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'bebranie'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        }
+    }
+
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DATABASE_ENGINE == 'postgresql':
+        host, _, port = replica.strip().partition(':')
+        DATABASES[alias].update(HOST=host, PORT=port or DATABASES['default']['PORT'])
+    else:
+        DATABASES[alias]['NAME'] = replica.strip()
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['api.routing.PrimaryReplicaRouter']
+
+# Users are read from the primary for DATABASE_PIN_SECONDS after a
+# successful write, which should exceed the replication lag. Use a shared
+# cache alias when running several processes.
+DATABASE_PIN_SECONDS = 10
+DATABASE_PIN_CACHE_ALIAS = 'default'
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -136,7 +223,143 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Keep stored files in an S3-compatible object store (needs boto3) when
+# S3_BUCKET is set. Local MEDIA_ROOT is then only used for upload scratch files.
+S3_STORAGE = {
+    'BUCKET': os.environ.get('S3_BUCKET', ''),
+    'PREFIX': os.environ.get('S3_PREFIX', ''),
+    'ENDPOINT_URL': os.environ.get('S3_ENDPOINT_URL', ''),
+    'REGION': os.environ.get('S3_REGION', ''),
+    'ACCESS_KEY_ID': os.environ.get('S3_ACCESS_KEY_ID', ''),
+    'SECRET_ACCESS_KEY': os.environ.get('S3_SECRET_ACCESS_KEY', ''),
+}
+if S3_STORAGE['BUCKET']:
+    DEFAULT_FILE_STORAGE = 'api.s3.S3Storage'
+
+# Files larger than the threshold are uploaded in parts of S3_MULTIPART_CHUNK_SIZE
+# bytes, up to S3_MAX_CONCURRENCY parts at a time.
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+S3_MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+S3_MAX_CONCURRENCY = 8
+
+# Answer view and download links with a redirect to a presigned URL of the
+# storage, valid for FILE_REDIRECT_EXPIRES seconds, when the storage supports it.
+FILE_REDIRECTS = os.environ.get('FILE_REDIRECTS', '') == '1'
+FILE_REDIRECT_EXPIRES = 5 * 60
+
+# File list page size when no ``limit`` is given (lists without parameters
+# that are longer come paginated), and the upper bound for ``limit``.
+FILE_LIST_PAGE_SIZE = 100
+FILE_LIST_MAX_PAGE_SIZE = 1000
+
+# Bulk upload: files per request and threads writing them to storage.
+BULK_UPLOAD_MAX_FILES = 100
+BULK_UPLOAD_WORKERS = 4
+
+# Files per ZIP archive download.
+ARCHIVE_MAX_FILES = 1000
+
+# Deleted files are removed from storage by ``manage.py reclaim_blobs``
+# in batches; failed deletions are retried after RETRY_DELAY seconds,
+# doubled after every attempt.
+RECLAIM_BATCH_SIZE = 500
+RECLAIM_MAX_ATTEMPTS = 10
+RECLAIM_RETRY_DELAY = 60
+
+# Previews served by view links with ?preview=<size>: images and the first
+# PDF page scaled to at most <size> pixels (needs Pillow, and PyMuPDF for
+# PDFs), text cut to PREVIEW_TEXT_BYTES. They are rendered by PREVIEW_WORKERS
+# processes, lazily or by the upload pipeline for PREVIEW_EAGER_SIZES, and cached
+# in PREVIEW_ROOT (MEDIA_ROOT/previews when None).
+PREVIEW_SIZES = (64, 128, 256, 512, 1024)
+PREVIEW_TEXT_BYTES = 4096
+PREVIEW_WORKERS = 2
+PREVIEW_TIMEOUT = 10
+PREVIEW_EAGER_SIZES = ()
+PREVIEW_ROOT = None
+
+# Stages run on every new file by the job worker (manage.py run_jobs), in order.
+FILE_PIPELINE_STAGES = [
+    'api.pipeline.verify_checksum',
+    'api.pipeline.detect_content_type',
+    'api.pipeline.render_previews',
+]
+
+# Job queue: worker threads per run_jobs process, attempts per job, base
+# retry delay (seconds, doubled on every retry) and after how long (seconds)
+# a running job whose worker disappeared is queued again. Done and failed
+# jobs are deleted JOB_RETENTION seconds after finishing (None keeps them),
+# checked by run_jobs every JOB_PRUNE_INTERVAL seconds.
+JOB_CONCURRENCY = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 30
+JOB_LOCK_TIMEOUT = 10 * 60
+JOB_RETENTION = 7 * 24 * 60 * 60
+JOB_PRUNE_INTERVAL = 60 * 60
+
+# Bytes each user may store in total; None for no limit.
+USER_STORAGE_QUOTA = None
+
+# How long (seconds) browsers and shared caches may reuse public files.
+FILE_CACHE_MAX_AGE = 60 * 60
+
+# Signed share links: default and maximum lifetime (seconds), whether links
+# carry the storage path so serving them needs no File lookup, and where
+# link key versions are cached (use a shared cache with several processes).
+SIGNED_LINKS = {
+    'TTL': 60 * 60,
+    'MAX_TTL': 7 * 24 * 60 * 60,
+    'INCLUDE_PATH': True,
+    'CACHE_ALIAS': 'default',
+    'VERSION_TTL': 5 * 60,
+}
+
+# Widths of the nested directory levels stored files are spread over, taken
+# from the start of their names: (2, 2) stores ab12cd... as ab/12/ab12cd...
+# Run the relayout_files command after changing it.
+FILE_STORAGE_FANOUT = (2, 2)
+
+# Store compressible uploads gzip-compressed. A sample of COMPRESS_SAMPLE_SIZE
+# bytes must compress to at most COMPRESS_MAX_RATIO of its size.
+COMPRESS_AT_REST = False
+COMPRESS_SAMPLE_SIZE = 64 * 1024
+COMPRESS_MIN_SIZE = 512
+COMPRESS_MAX_RATIO = 0.9
+COMPRESS_LEVEL = 6
+
+FILE_UPLOAD_HANDLERS = [
+    'api.uploadhandlers.HashingMemoryFileUploadHandler',
+    'api.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Resumable chunked uploads (sizes in bytes, TTL in seconds)
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_MAX_SIZE = 10 * 1024 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Download counters are buffered in process and flushed every
+# DOWNLOAD_COUNTER_FLUSH_INTERVAL seconds or once MAX_PENDING downloads
+# are collected. An interval of 0 writes every download immediately.
+
+DOWNLOAD_COUNTER_FLUSH_INTERVAL = 5
+DOWNLOAD_COUNTER_MAX_PENDING = 1000
+
+# Flushed downloads are also logged as events and rolled up into hourly
+# and daily buckets by a job run every DOWNLOAD_ROLLUP_INTERVAL seconds.
+# Events younger than DOWNLOAD_ROLLUP_DELAY wait for late commits; rolled
+# up events and hourly buckets are kept for the given number of seconds.
+
+DOWNLOAD_ROLLUP_INTERVAL = 5 * 60
+DOWNLOAD_ROLLUP_DELAY = 60
+DOWNLOAD_ROLLUP_BATCH_SIZE = 5000
+DOWNLOAD_EVENT_RETENTION = 2 * 24 * 60 * 60
+DOWNLOAD_HOURLY_RETENTION = 14 * 24 * 60 * 60
+TRENDING_LIMIT = 20
+TRENDING_MAX_DAYS = 90
@@ -0,0 +1,105 @@
+"""
+Compare rows per second of the file listing built through
+FileListSerializer and JSONRenderer with the values() fast path and
+FastJSONRenderer, at several page sizes.
+
+Both sides fetch the page from the database, build the representation
+and render it to JSON, as FileViewSet.list does.
+
+    python benchmarks/file_listing.py --sizes 100 1000 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bebranie.settings')
+
+
+def setup(workdir, count):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'db.sqlite3')
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    settings.DEBUG = False
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from api.models import File
+
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='bench', email='bench@example.com')
+    File.objects.bulk_create(
+        File(
+            author=user,
+            access='public',
+            file=f'files/{user.pk}/{i:08x}.txt',
+            token=f'{i:032x}.txt',
+            name=f'report {i}.txt',
+            download_count=i % 100,
+            size=i,
+            content_type='text/plain'
+        )
+        for i in range(count)
+    )
+
+
+def serializer_page(request, size):
+    from rest_framework.renderers import JSONRenderer
+    from api.models import File
+    from api.serializers import FileListSerializer
+
+    files = File.objects.order_by('-download_count', '-id')[:size]
+    data = FileListSerializer(files, many=True, context={'request': request}).data
+    return JSONRenderer().render(data)
+
+
+def values_page(request, size):
+    from api.models import File
+    from api.renderers import FastJSONRenderer
+    from api.serializers import FileListValues
+
+    values = FileListValues({'request': request})
+    rows = File.objects.order_by('-download_count', '-id').values(*values.keys)[:size]
+    return FastJSONRenderer().render(values.represent(rows))
+
+
+def measure(build, request, size, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = build(request, size)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5, help='runs per size, the best counts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        setup(workdir, max(args.sizes))
+        from rest_framework.test import APIRequestFactory
+        from api.renderers import orjson
+
+        request = APIRequestFactory().get('/api/files/')
+        print(f'orjson {"installed" if orjson is not None else "missing"}')
+        for size in args.sizes:
+            slow, expected = measure(serializer_page, request, size, args.repeat)
+            fast, body = measure(values_page, request, size, args.repeat)
+            assert body == expected, 'outputs differ'
+            print(
+                f'{size:6} rows  serializer {slow:10.0f} rows/s  '
+                f'values {fast:10.0f} rows/s  {fast / slow:5.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
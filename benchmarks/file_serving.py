@@ -0,0 +1,152 @@
+"""
+Compare concurrent slow downloads served through WSGI and through the
+ASGI handler with async file views.
+
+Every simulated client reads the response body with a fixed delay per
+message, the way a slow mobile connection does. The WSGI side is given a
+fixed number of worker threads, as a threaded WSGI server would be; the
+ASGI side runs every client on a single event loop.
+
+    python benchmarks/file_serving.py --clients 200 --threads 16
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bebranie.settings')
+
+
+def setup(workdir, size):
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = os.path.join(workdir, 'db.sqlite3')
+    settings.MEDIA_ROOT = os.path.join(workdir, 'media')
+    settings.DEBUG = False
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+    from api.models import File
+
+    call_command('migrate', verbosity=0)
+    user = get_user_model().objects.create(username='bench', email='bench@example.com')
+    file = File(author=user, access='public')
+    file.file.save('bench.bin', ContentFile(os.urandom(size)))
+    return file.token
+
+
+def use_async_views(enabled):
+    from django.conf import settings
+    from django.urls import clear_url_caches
+    import api.urls
+    import bebranie.urls
+
+    settings.ASYNC_FILE_SERVING = enabled
+    importlib.reload(api.urls)
+    importlib.reload(bebranie.urls)
+    clear_url_caches()
+
+
+def run_wsgi(token, clients, threads, delay):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    use_async_views(False)
+    application = WSGIHandler()
+
+    def client(_):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': f'/api/files/view/{token}/',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': BytesIO(),
+        }
+        received = 0
+        response = application(environ, lambda status, headers: None)
+        try:
+            for chunk in response:
+                received += len(chunk)
+                time.sleep(delay)
+        finally:
+            response.close()
+        return received
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return sum(executor.map(client, range(clients)))
+
+
+def run_asgi(token, clients, delay):
+    from api.asgi import FileStreamingASGIHandler
+
+    use_async_views(True)
+    application = FileStreamingASGIHandler()
+
+    async def client():
+        received = 0
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': f'/api/files/view/{token}/',
+            'query_string': b'',
+            'headers': [],
+            'server': ('localhost', 80),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            nonlocal received
+            if message['type'] == 'http.response.body' and message.get('body'):
+                received += len(message['body'])
+                await asyncio.sleep(delay)
+
+        await application(scope, receive, send)
+        return received
+
+    async def main():
+        return sum(await asyncio.gather(*(client() for _ in range(clients))))
+
+    return asyncio.run(main())
+
+
+def report(name, clients, received, elapsed):
+    print(
+        f'{name:5} {clients} clients  {elapsed:7.2f}s  '
+        f'{received / elapsed / 2 ** 20:8.1f} MiB/s  '
+        f'{clients / elapsed:7.1f} downloads/s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help='WSGI worker threads')
+    parser.add_argument('--size', type=int, default=1024 * 1024, help='file size in bytes')
+    parser.add_argument('--delay', type=float, default=0.01, help='seconds per received chunk')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        token = setup(workdir, args.size)
+
+        started = time.perf_counter()
+        received = run_wsgi(token, args.clients, args.threads, args.delay)
+        report('wsgi', args.clients, received, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        received = run_asgi(token, args.clients, args.delay)
+        report('asgi', args.clients, received, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    main()